@@ -0,0 +1,75 @@
+"""导入耗时基准：python bench_import.py [--budget-ms 40] [--runs 5]
+
+用 `python -X importtime -c "import pic2epub"` 测量导入 pic2epub 的累计耗时，
+取多次运行的最小值与预算比较，超出预算或加载了重量级模块时返回非零退出码。
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 这些模块只应在首次使用时导入
+HEAVY_MODULES = ("tkinter", "lxml", "PIL", "zipfile", "subprocess", "tempfile", "shutil", "numpy")
+
+
+def measure_once():
+    """运行一次 -X importtime，返回 (pic2epub 累计微秒, [(累计微秒, 模块名)])"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import pic2epub"],
+        cwd=HERE, capture_output=True, text=True, check=True
+    )
+    total = None
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        entries.append((int(cumulative_us), name))
+        if name == "pic2epub":
+            total = int(cumulative_us)
+    return total, entries
+
+
+def loaded_heavy_modules():
+    """返回导入 pic2epub 后被加载的重量级模块"""
+    code = (
+        "import sys, pic2epub; "
+        "print(' '.join(m for m in %r if m in sys.modules))" % (HEAVY_MODULES,)
+    )
+    proc = subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True, check=True)
+    return proc.stdout.split()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure pic2epub import time")
+    parser.add_argument("--budget-ms", type=float, default=40.0, help="导入耗时预算（毫秒）")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数，取最小值")
+    parser.add_argument("--top", type=int, default=10, help="显示最慢的模块数量")
+    args = parser.parse_args(argv)
+
+    best_total, best_entries = None, []
+    for _ in range(max(1, args.runs)):
+        total, entries = measure_once()
+        if best_total is None or total < best_total:
+            best_total, best_entries = total, entries
+
+    print(f"import pic2epub: {best_total / 1000:.1f} ms (budget {args.budget_ms:.1f} ms)")
+    for cumulative_us, name in sorted(best_entries, reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    heavy = loaded_heavy_modules()
+    if heavy:
+        print(f"FAIL: heavy modules loaded at import: {', '.join(heavy)}")
+        failed = True
+    if best_total / 1000 > args.budget_ms:
+        print("FAIL: import time over budget")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
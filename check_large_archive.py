@@ -0,0 +1,121 @@
+"""大型归档检查：python check_large_archive.py [--pages 70000]
+
+在临时目录中生成一本由极小图片组成的超大书籍（默认 70000 页，超过传统 ZIP 的 65535 个条目上限），
+分别按 large_archive 的 "warn"、"split"、"zip64" 策略生成 EPUB，检查条目数、testzip()、
+validate_epub() 的结果以及每个分卷的条目数；另外检查恰好 65535 个条目时已需要 ZIP64。
+任一检查失败时返回非零退出码。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+import pic2epub  # noqa: E402
+
+# 每页一张图片和一个 XHTML，另有 mimetype、container.xml、content.opf、toc.ncx
+ENTRIES_PER_PAGE = 2
+FIXED_ENTRIES = pic2epub.FIXED_ENTRY_COUNT
+# 分卷时每卷最多的条目数
+MAX_VOLUME_ENTRIES = pic2epub.ZIP_MAX_ENTRIES - 1
+
+
+def make_book(folder, pages):
+    """生成 pages 张 1x1 的 PNG（各自独立的文件，避免硬链接数上限）"""
+    os.makedirs(folder)
+    data = pic2epub._placeholder_png(1, 1)
+    for i in range(pages):
+        with open(os.path.join(folder, f"{i:06d}.png"), "wb") as f:
+            f.write(data)
+
+
+def check_archive(path, failures):
+    """检查一个 EPUB，返回条目数"""
+    with zipfile.ZipFile(path) as zf:
+        entries = len(zf.infolist())
+        bad = zf.testzip()
+    if bad is not None:
+        failures.append(f"{path}: testzip() reported {bad}")
+    problems = pic2epub.validate_epub(path)
+    if problems:
+        failures.append(f"{path}: {len(problems)} validation problem(s), first: {problems[0]}")
+    return entries
+
+
+def check_boundary(book, pages, failures):
+    """条目数边界：65534 个条目仍是传统 ZIP，恰好 65535 个（0xFFFF，ZIP64 标记值）就需要 ZIP64"""
+    limit = pic2epub.ZIP_MAX_ENTRIES
+    for entries, expected in ((limit - 1, False), (limit, True), (limit + 1, True)):
+        if pic2epub.exceeds_classic_zip(entries, 0) != expected:
+            failures.append(f"boundary: exceeds_classic_zip({entries}) should be {expected}")
+
+    # 页数换算成条目数后是偶数，用紧挨着上限两侧的页数检查 needs_zip64
+    names = sorted(os.listdir(book))
+    below = (limit - 1 - FIXED_ENTRIES) // ENTRIES_PER_PAGE
+    for count, expected in ((below, False), (below + 1, True)):
+        if count > pages:
+            continue
+        paths = [os.path.join(book, name) for name in names[:count]]
+        if pic2epub.needs_zip64(paths) != expected:
+            entries = pic2epub.estimate_archive(paths)[0]
+            failures.append(f"boundary: needs_zip64 with {entries} entries should be {expected}")
+    print(f"boundary: ZIP64 from {limit} entries")
+
+
+def run_policy(book, output_dir, policy, pages, failures):
+    options = pic2epub.ConversionOptions(large_archive=policy, skip_unchanged=False)
+    started = time.monotonic()
+    result = pic2epub.run_single_conversion(
+        book, lambda current, total: None, threading.Event(), output_dir=output_dir,
+        overwrite_policy=pic2epub.OverwritePolicy("overwrite"), options=options)
+    elapsed = time.monotonic() - started
+    outputs = result if isinstance(result, list) else [result]
+
+    counts = [check_archive(path, failures) for path in outputs]
+    print(f"{policy:>6}: {len(outputs)} file(s), entries {' + '.join(map(str, counts))} ({elapsed:.1f} s)")
+
+    if policy == "split":
+        if len(outputs) < 2:
+            failures.append(f"split: expected several volumes, got {len(outputs)}")
+        for path, count in zip(outputs, counts):
+            if count > MAX_VOLUME_ENTRIES:
+                failures.append(f"split: {path} has {count} entries (limit {MAX_VOLUME_ENTRIES})")
+        page_entries = sum(count - FIXED_ENTRIES for count in counts)
+    else:
+        if len(outputs) != 1:
+            failures.append(f"{policy}: expected one file, got {len(outputs)}")
+        page_entries = sum(counts) - FIXED_ENTRIES * len(counts)
+    if page_entries != pages * ENTRIES_PER_PAGE:
+        failures.append(f"{policy}: {page_entries} page entries, expected {pages * ENTRIES_PER_PAGE}")
+
+    for path in outputs:
+        os.remove(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a synthetic book past the ZIP entry limit")
+    parser.add_argument("--pages", type=int, default=70000, help="页数")
+    parser.add_argument("--policy", action="append", choices=("warn", "split", "zip64"),
+                        help="只检查指定的策略（可重复），默认全部")
+    args = parser.parse_args(argv)
+
+    failures = []
+    with tempfile.TemporaryDirectory(prefix="pic2epub-large-") as tmp:
+        book = os.path.join(tmp, "book")
+        make_book(book, args.pages)
+        check_boundary(book, args.pages, failures)
+        for policy in args.policy or ("warn", "split", "zip64"):
+            run_policy(book, tmp, policy, args.pages, failures)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,14 @@
 import os
 import sys
-import subprocess
-import tkinter as tk
-from tkinter import filedialog, messagebox, ttk
 import threading
 from pathlib import Path
-import shutil
-import tempfile
 import re
-from zipfile import ZipFile, ZIP_STORED
-from lxml import etree
 import time
+from functools import lru_cache
+
+# 注意：tkinter、lxml、Pillow、zipfile、subprocess 等较重的模块都在首次使用时才导入，
+# 以便作为库导入或在进程池中启动时不必为 GUI 和图像处理付出加载开销。
+# 修改导入时请用 bench_import.py 检查导入耗时预算。
 
 
 # ========== 精简的多语言字典 ==========
@@ -40,7 +38,24 @@ LANGUAGES = {
         "overwrite_skip": "跳过",
         "overwrite_overwrite": "覆盖",
         "overwrite_cancel": "取消",
-        "overwrite_apply_all": "应用于所有"
+        "overwrite_apply_all": "应用于所有",
+        "stage_scanning": "扫描图片文件中...",
+        "stage_verifying": "正在检查图片完整性...",
+        "stage_splitting": "正在拆分跨页...",
+        "stage_slicing": "正在切分长图...",
+        "stage_cropping": "正在裁剪空白边距...",
+        "stage_grayscale": "正在优化灰度页面...",
+        "stage_fitting": "正在按目标大小调整画质...",
+        "stage_packaging": "正在打包EPUB文件...",
+        "stage_validating": "正在校验EPUB文件...",
+        "stage_done": "完成",
+        "progress_metrics": "{pages:.1f} 页/秒 · 读 {read:.1f} MB/s · 写 {written:.1f} MB/s · 剩余 {eta}",
+        "conflict_message": "以下 {count} 个文件已存在，选中的文件将被覆盖：",
+        "conflict_overwrite_selected": "覆盖所选",
+        "conflict_overwrite_all": "全部覆盖",
+        "conflict_skip_all": "全部跳过",
+        "dependency_missing": "缺少依赖：{missing}\n是否立即安装？",
+        "dependency_installed": "依赖已安装，请重新启动程序。"
     },
     "English": {
         "window_title": "Pic2EPUB",
@@ -67,7 +82,24 @@ LANGUAGES = {
         "overwrite_skip": "Skip",
         "overwrite_overwrite": "Overwrite",
         "overwrite_cancel": "Cancel",
-        "overwrite_apply_all": "Apply to all"
+        "overwrite_apply_all": "Apply to all",
+        "stage_scanning": "Scanning image files...",
+        "stage_verifying": "Checking image integrity...",
+        "stage_splitting": "Splitting double-page spreads...",
+        "stage_slicing": "Slicing long strips...",
+        "stage_cropping": "Cropping blank margins...",
+        "stage_grayscale": "Optimizing grayscale pages...",
+        "stage_fitting": "Fitting pages to the size budget...",
+        "stage_packaging": "Packaging EPUB file...",
+        "stage_validating": "Validating EPUB file...",
+        "stage_done": "Done",
+        "progress_metrics": "{pages:.1f} pages/s · read {read:.1f} MB/s · write {written:.1f} MB/s · ETA {eta}",
+        "conflict_message": "{count} files already exist. Selected files will be overwritten:",
+        "conflict_overwrite_selected": "Overwrite selected",
+        "conflict_overwrite_all": "Overwrite all",
+        "conflict_skip_all": "Skip all",
+        "dependency_missing": "Missing dependency: {missing}\nInstall it now?",
+        "dependency_installed": "Dependencies installed. Please restart."
     }
 }
 
@@ -75,6 +107,8 @@ LANGUAGES = {
 class OverwriteDialog:
     """覆盖确认对话框"""
     def __init__(self, parent, filename, lang="中文"):
+        import tkinter as tk
+
         self.result = None
         self.apply_all = False
         
@@ -149,6 +183,100 @@ class OverwriteDialog:
         dialog.wait_window()
 
 
+class ConflictDialog:
+    """批量覆盖确认对话框：一次列出所有已存在的输出文件
+
+    result 为 {路径: 'skip'/'overwrite'}，用户取消时为 None；
+    default 为列表之外的冲突采用的决定（只有选择“全部覆盖”时为 'overwrite'）。
+    """
+    def __init__(self, parent, paths, lang="中文"):
+        import tkinter as tk
+
+        self.result = None
+        self.default = "skip"
+        tr = lambda k: LANGUAGES[lang].get(k, k)
+
+        dialog = tk.Toplevel(parent)
+        dialog.title(tr("overwrite_title"))
+        dialog.resizable(False, False)
+        dialog.transient(parent)
+        dialog.grab_set()
+
+        # 居中显示
+        parent.update_idletasks()
+        px = parent.winfo_rootx()
+        py = parent.winfo_rooty()
+        pw = parent.winfo_width()
+        ph = parent.winfo_height()
+        dx = px + (pw - 480) // 2
+        dy = py + (ph - 360) // 2
+        dialog.geometry(f"+{dx}+{dy}")
+
+        tk.Label(
+            dialog,
+            text=tr("conflict_message").format(count=len(paths)),
+            font=("微软雅黑", 10),
+            wraplength=440,
+            justify="left"
+        ).pack(padx=15, pady=(15, 5), anchor="w")
+
+        # 文件列表，可多选
+        list_frame = tk.Frame(dialog)
+        list_frame.pack(padx=15, pady=5, fill="both")
+        scrollbar = tk.Scrollbar(list_frame)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        listbox = tk.Listbox(list_frame, selectmode=tk.MULTIPLE, width=60, height=10,
+                             yscrollcommand=scrollbar.set, font=("微软雅黑", 9))
+        for path in paths:
+            listbox.insert(tk.END, os.path.basename(path))
+        listbox.pack(side=tk.LEFT, fill="both")
+        scrollbar.config(command=listbox.yview)
+
+        btn_frame = tk.Frame(dialog)
+        btn_frame.pack(pady=10)
+
+        def finish(decide):
+            if decide is not None:
+                selected = set(listbox.curselection())
+                self.result = {path: decide(i in selected) for i, path in enumerate(paths)}
+            dialog.destroy()
+
+        def overwrite_all():
+            self.default = "overwrite"
+            finish(lambda selected: "overwrite")
+
+        tk.Button(
+            btn_frame,
+            text=tr("conflict_overwrite_selected"),
+            command=lambda: finish(lambda selected: "overwrite" if selected else "skip"),
+            width=12
+        ).pack(side=tk.LEFT, padx=4)
+
+        tk.Button(
+            btn_frame,
+            text=tr("conflict_overwrite_all"),
+            command=overwrite_all,
+            width=12
+        ).pack(side=tk.LEFT, padx=4)
+
+        tk.Button(
+            btn_frame,
+            text=tr("conflict_skip_all"),
+            command=lambda: finish(lambda selected: "skip"),
+            width=12
+        ).pack(side=tk.LEFT, padx=4)
+
+        tk.Button(
+            btn_frame,
+            text=tr("overwrite_cancel"),
+            command=lambda: finish(None),
+            width=10
+        ).pack(side=tk.LEFT, padx=4)
+
+        dialog.protocol("WM_DELETE_WINDOW", lambda: finish(None))
+        dialog.wait_window()
+
+
 def extract_number(filename):
     """从文件名中提取数字用于排序"""
     match = re.search(r'\d+', filename)
@@ -194,43 +322,80 @@ def sort_image_files(image_files):
 
 
 def check_and_install_deps():
-    """检查并安装依赖"""
+    """检查并安装依赖（只查找模块，不导入，避免拖慢启动）"""
+    import importlib.util
+
+    missing = None
+    for module, package in (("PIL", "Pillow"), ("lxml", "lxml")):
+        if importlib.util.find_spec(module) is None:
+            missing = package
+            break
+    if missing is None:
+        return
+
+    import subprocess
+    from tkinter import messagebox
+
+    msg = LANGUAGES["中文"]["dependency_missing"].format(missing=missing)
+    if messagebox.askyesno("Dependency Missing", msg):
+        try:
+            subprocess.check_call([sys.executable, "-m", "pip", "install", missing])
+            messagebox.showinfo("Success", LANGUAGES["中文"]["dependency_installed"])
+            sys.exit(0)
+        except Exception as install_err:
+            messagebox.showerror("Install Failed", str(install_err))
+            sys.exit(1)
+    else:
+        sys.exit(0)
+
+
+def warm_up_imports():
+    """在后台预先加载 Pillow 和 lxml，使首次转换不必等待导入"""
     try:
         from PIL import Image
-        import lxml.etree
-    except ImportError as e:
-        missing = str(e).split()[-1].strip("'")
-        if missing == "lxml":
-            missing = "lxml"
-        elif missing == "PIL":
-            missing = "Pillow"
-            
-        msg = LANGUAGES["中文"]["dependency_missing"] if "中文" in LANGUAGES else f"Missing dependency: {missing}"
-        if messagebox.askyesno("Dependency Missing", msg):
-            try:
-                if missing == "lxml":
-                    subprocess.check_call([sys.executable, "-m", "pip", "install", "lxml"])
-                else:
-                    subprocess.check_call([sys.executable, "-m", "pip", "install", "Pillow"])
-                messagebox.showinfo("Success", LANGUAGES["中文"]["dependency_installed"] if "中文" in LANGUAGES else "Dependencies installed. Please restart.")
-                sys.exit(0)
-            except Exception as install_err:
-                messagebox.showerror("Install Failed", str(install_err))
-                sys.exit(1)
-        else:
-            sys.exit(0)
+        Image.init()
+        import lxml.etree  # noqa: F401
+    except ImportError:
+        pass
+
 
+# 常见图片格式，命中时无需初始化 Pillow 的全部插件
+COMMON_IMAGE_EXTENSIONS = frozenset({
+    '.jpg', '.jpeg', '.jpe', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff'
+})
 
+
+@lru_cache(maxsize=None)
 def get_supported_image_extensions():
-    """获取支持的图片格式"""
+    """获取支持的图片格式（结果会被缓存）"""
     from PIL import Image
     exts = Image.registered_extensions()
-    return {ext.lower() for ext in exts.keys()}
+    return frozenset(ext.lower() for ext in exts.keys())
+
+
+def is_supported_image(filename):
+    """判断文件是否为支持的图片，仅对不常见的扩展名才查询 Pillow"""
+    ext = Path(filename).suffix.lower()
+    if not ext:
+        return False
+    if ext in COMMON_IMAGE_EXTENSIONS:
+        return True
+    return ext in get_supported_image_extensions()
 
 
-def scan_images(folder, progress_callback=None, stop_event=None):
-    """扫描文件夹中的图片文件，忽略EPUB文件"""
-    supported = get_supported_image_extensions()
+def scan_images(folder, progress_callback=None, stop_event=None, index=None):
+    """扫描文件夹中的图片文件，忽略EPUB文件
+
+    folder 位于已打开的书库索引中且自上次扫描后未改变时，直接使用索引中的结果。
+    """
+    if index is None:
+        index = LibraryIndex.for_folder(folder)
+    if index is not None:
+        image_files = [name for name, _size, _media_type in index.images(folder, stop_event)]
+        if progress_callback:
+            progress_callback(len(image_files), len(image_files))
+        return image_files, []
+
     try:
         # 过滤掉EPUB文件
         all_files = [f for f in os.listdir(folder) 
@@ -246,7 +411,7 @@ def scan_images(folder, progress_callback=None, stop_event=None):
         if stop_event and stop_event.is_set():
             raise InterruptedError("User cancelled")
             
-        if Path(f).suffix.lower() in supported:
+        if is_supported_image(f):
             image_files.append(f)
         
         # 每处理一个文件就更新进度
@@ -273,16 +438,1770 @@ def get_image_media_type(filename):
         return 'image/jpeg'  # 默认
 
 
-def create_epub_from_images(image_paths, output_file, book_title, progress_callback=None, stop_event=None):
-    """从图片列表创建EPUB文件"""
-    # 确保临时目录存在
-    os.makedirs('META-INF', exist_ok=True)
-    os.makedirs('OEBPS/images', exist_ok=True)
-    os.makedirs('OEBPS/text', exist_ok=True)
+# ========== 进度指标 ==========
+class ProgressMetrics:
+    """转换过程的实时指标：当前阶段、页数、读写字节数、速率和剩余时间
+
+    速率用指数移动平均平滑，ETA 根据整体进度的平滑速率估算。
+    进度回调以 progress_callback(current, total, metrics) 的形式收到它。
+    """
+    # 两次采样之间的最短间隔（秒），避免频繁更新导致速率抖动
+    SAMPLE_INTERVAL = 0.25
+
+    def __init__(self, stage="scanning", smoothing=0.3):
+        self.stage = stage
+        self.smoothing = smoothing
+        self.pages_done = 0
+        self.pages_total = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.fraction = 0.0
+        self.pages_per_sec = 0.0
+        self.read_bytes_per_sec = 0.0
+        self.write_bytes_per_sec = 0.0
+        self.eta = None
+        self._fraction_rate = 0.0
+        self._sample = None
+
+    def set_stage(self, stage, pages_total=0):
+        """进入新阶段：页数从零开始计，速率和 ETA 重新采样（各阶段速度不同，沿用上一阶段的估计会失真）"""
+        self.stage = stage
+        self.pages_done = 0
+        self.pages_total = pages_total
+        self.pages_per_sec = 0.0
+        self.eta = None
+        self._fraction_rate = 0.0
+        self._sample = None
+
+    def add_bytes(self, read=0, written=0):
+        self.bytes_read += read
+        self.bytes_written += written
+
+    def update(self, pages_done=None, fraction=None):
+        """更新页数和整体进度，并按采样间隔刷新平滑速率"""
+        if pages_done is not None:
+            self.pages_done = pages_done
+        if fraction is not None:
+            self.fraction = min(1.0, max(0.0, fraction))
+            if self.fraction >= 1.0:
+                self.eta = 0.0
+
+        now = time.monotonic()
+        current = (now, self.pages_done, self.bytes_read, self.bytes_written, self.fraction)
+        if self._sample is None:
+            self._sample = current
+            return
+        dt = now - self._sample[0]
+        if dt < self.SAMPLE_INTERVAL:
+            return
+        rates = [(new - old) / dt for new, old in zip(current[1:], self._sample[1:])]
+        self._sample = current
+
+        def smooth(previous, sample):
+            return sample if previous == 0 else self.smoothing * sample + (1 - self.smoothing) * previous
+
+        self.pages_per_sec = smooth(self.pages_per_sec, rates[0])
+        self.read_bytes_per_sec = smooth(self.read_bytes_per_sec, rates[1])
+        self.write_bytes_per_sec = smooth(self.write_bytes_per_sec, rates[2])
+        self._fraction_rate = smooth(self._fraction_rate, rates[3])
+        if self._fraction_rate > 0 and self.fraction < 1.0:
+            self.eta = (1.0 - self.fraction) / self._fraction_rate
+
+    def format_eta(self):
+        if self.eta is None:
+            return "--:--"
+        minutes, seconds = divmod(int(self.eta), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+    def as_dict(self):
+        return {
+            "stage": self.stage,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "pages_per_sec": round(self.pages_per_sec, 2),
+            "read_mb_per_sec": round(self.read_bytes_per_sec / 1e6, 2),
+            "write_mb_per_sec": round(self.write_bytes_per_sec / 1e6, 2),
+            "eta_seconds": None if self.eta is None else round(self.eta, 1),
+        }
+
+
+def _accepts_metrics(callback):
+    """回调能否接受第三个位置参数 metrics"""
+    import inspect
+
+    try:
+        params = inspect.signature(callback).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    positional = 0
+    for param in params:
+        if param.kind == param.VAR_POSITIONAL:
+            return True
+        if param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD):
+            positional += 1
+    return positional >= 3
+
+
+def _metrics_progress(callback):
+    """把进度回调统一为 report(current, total, metrics)
+
+    只接受 (current, total) 的旧回调照常调用，不会收到 metrics。
+    """
+    if callback is None or _accepts_metrics(callback):
+        return callback
+    return lambda current, total, metrics=None: callback(current, total)
+
+
+# ========== 转换选项 ==========
+class ConversionOptions:
+    """转换选项
+
+    除 RUNTIME_ONLY 中的项目外，所有选项都会影响输出内容，因此参与输入指纹计算。
+    """
+    # 不影响输出内容的选项
+    RUNTIME_ONLY = ("skip_unchanged", "workers", "validate")
+    # 取值有限的选项
+    CHOICES = {
+        "large_archive": ("warn", "split", "zip64"),
+        "bad_image_policy": ("fail", "skip", "placeholder"),
+        "grayscale_png_bits": (4, 8),
+    }
+    # 可以为 None 的选项及其允许的类型
+    NULLABLE_TYPES = {"workers": (int,), "target_size": (int, str), "cover_min_quality": (int,)}
+
+    def __init__(self, skip_unchanged=True, workers=None, strip_jpeg_metadata=False, jpeg_strip_segments=None,
+                 grayscale=False, grayscale_tolerance=12, grayscale_max_color_ratio=0.002,
+                 grayscale_png_bits=8, grayscale_jpeg_quality="keep",
+                 autocrop=False, autocrop_tolerance=24, autocrop_max_ratio=0.25,
+                 slice_strips=False, slice_min_ratio=3.0, slice_target_ratio=1.5, slice_tolerance=0.25,
+                 slice_gutter_std=4.0, large_archive="warn",
+                 verify_images=False, verify_full=False, bad_image_policy="fail",
+                 split_spreads=False, spread_min_ratio=1.2, right_to_left=False, validate=False,
+                 target_size=None, size_min_quality=30, size_max_quality=95, cover_min_quality=80,
+                 size_sample_pages=12):
+        self.skip_unchanged = skip_unchanged  # 输入指纹未变时跳过重建
+        self.workers = workers  # 图片处理进程数，None 表示 CPU 核数
+        self.strip_jpeg_metadata = strip_jpeg_metadata  # 打包时去掉 JPEG 中的元数据段
+        self.jpeg_strip_segments = list(jpeg_strip_segments or DEFAULT_JPEG_STRIP_SEGMENTS)
+        self.grayscale = grayscale  # 把实际为黑白的彩色页面转换为灰度
+        self.grayscale_tolerance = grayscale_tolerance  # 通道差不超过该值视为灰色
+        self.grayscale_max_color_ratio = grayscale_max_color_ratio  # 允许的彩色像素比例
+        self.grayscale_png_bits = grayscale_png_bits  # PNG 灰度位深：8 或 4（16 级调色板）
+        self.grayscale_jpeg_quality = grayscale_jpeg_quality  # "keep" 表示沿用原图的亮度量化表
+        self.autocrop = autocrop  # 裁掉扫描件的空白边距
+        self.autocrop_tolerance = autocrop_tolerance  # 与背景亮度差超过该值视为内容
+        self.autocrop_max_ratio = autocrop_max_ratio  # 每个方向最多裁掉的比例，超过则不裁剪该方向
+        self.slice_strips = slice_strips  # 把条漫长图切成多页
+        self.slice_min_ratio = slice_min_ratio  # 高宽比达到该值才视为长图
+        self.slice_target_ratio = slice_target_ratio  # 切出页面的目标高宽比
+        self.slice_tolerance = slice_tolerance  # 在目标高度 ±该比例范围内寻找空白间隙
+        self.slice_gutter_std = slice_gutter_std  # 行像素标准差不超过该值视为空白间隙
+        self.large_archive = large_archive  # 超过 ZIP 传统上限时："warn" 自动 ZIP64 并警告，"split" 分卷，"zip64" 始终使用 ZIP64
+        self.verify_images = verify_images  # 打包前检查图片是否损坏
+        self.verify_full = verify_full  # 除文件头和结束标记外，再用 Pillow 完整解码
+        self.bad_image_policy = bad_image_policy  # 损坏图片的处理："fail" 失败，"skip" 跳过，"placeholder" 用占位图替换
+        self.split_spreads = split_spreads  # 把横向的跨页拆成左右两页
+        self.spread_min_ratio = spread_min_ratio  # 宽高比达到该值才视为跨页
+        self.right_to_left = right_to_left  # 从右向左翻页（日漫），拆分时右半页在前
+        self.validate = validate  # 打包后校验 EPUB 结构，失败时不替换已有输出
+        self.target_size = target_size  # 目标大小（字节数或 "200MB" 这样的字符串），超出时降低 JPEG 画质
+        self.size_min_quality = size_min_quality  # 按目标大小重新编码时的最低画质
+        self.size_max_quality = size_max_quality  # 按目标大小重新编码时的最高画质
+        self.cover_min_quality = cover_min_quality  # 封面的最低画质，None 表示与其他页面相同
+        self.size_sample_pages = size_sample_pages  # 估算画质与大小关系时抽样的页数
+
+    def copy(self, **changes):
+        """返回修改了部分选项的副本，未知选项抛出 ValueError"""
+        return ConversionOptions.from_dict(dict(vars(self), **changes))
+
+    def for_book(self, folder):
+        """书籍文件夹中有 pic2epub.json 时，用其中的选项覆盖当前选项"""
+        import json
+
+        config_path = os.path.join(folder, BOOK_OPTIONS_FILE)
+        if not os.path.isfile(config_path):
+            return self
+        with open(config_path, encoding="utf-8") as f:
+            overrides = json.load(f)
+        if not isinstance(overrides, dict):
+            raise ValueError(f"{config_path}: expected a JSON object")
+        return self.copy(**overrides)
+
+    def settings(self):
+        """返回影响输出内容的选项"""
+        return {k: v for k, v in sorted(vars(self).items()) if k not in self.RUNTIME_ONLY}
+
+    @classmethod
+    def from_dict(cls, data):
+        """从字典创建选项（服务模式的 JSON），未知选项或取值类型不对时抛出 ValueError"""
+        if data is not None and not isinstance(data, dict):
+            raise ValueError("options must be a JSON object")
+        options = cls()
+        for key, value in (data or {}).items():
+            if not isinstance(key, str) or key.startswith("_") or key not in vars(options):
+                raise ValueError(f"Unknown option: {key}")
+            cls._check_value(key, value, getattr(options, key))
+            setattr(options, key, value)
+        return options
+
+    @classmethod
+    def _check_value(cls, key, value, default):
+        """按默认值的类型检查选项取值，不合法时抛出 ValueError"""
+        is_int = isinstance(value, int) and not isinstance(value, bool)
+        if key in cls.CHOICES:
+            valid = value in cls.CHOICES[key] and not isinstance(value, bool)
+        elif key == "grayscale_jpeg_quality":
+            valid = value == "keep" or (is_int and 1 <= value <= 100)
+        elif key in cls.NULLABLE_TYPES:
+            valid = value is None or (isinstance(value, cls.NULLABLE_TYPES[key]) and not isinstance(value, bool))
+        elif isinstance(default, bool):
+            valid = isinstance(value, bool)
+        elif isinstance(default, int):
+            valid = is_int
+        elif isinstance(default, float):
+            valid = is_int or isinstance(value, float)
+        elif isinstance(default, list):
+            valid = isinstance(value, list) and all(isinstance(item, str) for item in value)
+        else:
+            valid = isinstance(value, type(default))
+        if not valid:
+            raise ValueError(f"Invalid value for option {key}: {value!r}")
+
+
+# 书籍文件夹中的单书选项文件
+BOOK_OPTIONS_FILE = "pic2epub.json"
+
+
+# ========== 可重复构建 ==========
+# 固定的 zip 时间戳，使相同输入得到逐字节相同的输出
+FIXED_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+# 输入指纹格式版本，打包逻辑改变输出时递增
+FINGERPRINT_VERSION = 3
+FINGERPRINT_META_NAME = "pic2epub:fingerprint"
+FINGERPRINT_COMMENT_PREFIX = b"pic2epub:fingerprint="
+
+
+def compute_input_fingerprint(image_paths, book_title, options=None):
+    """根据文件列表、大小、修改时间和选项计算输入指纹（只需 stat，不读取图片内容）"""
+    import hashlib
+    import json
+
+    options = options or ConversionOptions()
+    # 路径相对于书籍文件夹（合并书籍为各子文件夹的公共上级），移动或复制书库后指纹不变
+    paths = [os.path.abspath(path) for path in image_paths]
+    try:
+        base = os.path.commonpath([os.path.dirname(path) for path in paths]) if paths else ""
+    except ValueError:
+        # 不同驱动器上的文件没有公共路径
+        base = ""
+    files = []
+    for path in paths:
+        st = os.stat(path)
+        name = os.path.relpath(path, base) if base else path
+        files.append([name.replace(os.sep, "/"), st.st_size, st.st_mtime_ns])
+    payload = {
+        "version": FINGERPRINT_VERSION,
+        "title": book_title,
+        "settings": options.settings(),
+        "files": files,
+    }
+    data = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_epub_fingerprint(epub_path):
+    """从 EPUB 的 zip 注释中读取输入指纹，只读取文件末尾的目录结束记录"""
+    import struct
+
+    try:
+        with open(epub_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            tail_size = min(size, 22 + 0xFFFF)
+            f.seek(size - tail_size)
+            tail = f.read(tail_size)
+    except OSError:
+        return None
+    pos = tail.rfind(b"PK\x05\x06")
+    if pos < 0 or pos + 22 > len(tail):
+        return None
+    comment_length = struct.unpack("<H", tail[pos + 20:pos + 22])[0]
+    comment = tail[pos + 22:pos + 22 + comment_length]
+    if not comment.startswith(FINGERPRINT_COMMENT_PREFIX):
+        return None
+    return comment[len(FINGERPRINT_COMMENT_PREFIX):].decode("ascii", "replace")
+
+
+def is_output_up_to_date(output_path, image_paths, book_title, options=None):
+    """已有输出的输入指纹与当前输入一致时返回 True"""
+    if not os.path.isfile(output_path):
+        return False
+    existing = read_epub_fingerprint(output_path)
+    return existing is not None and existing == compute_input_fingerprint(image_paths, book_title, options)
+
+
+def content_uuid(book_title, image_infos):
+    """由书名和每张图片的大小与 CRC32 得到稳定的书籍 UUID"""
+    import hashlib
+    import uuid
+
+    digest = hashlib.sha256(book_title.encode("utf-8"))
+    for zinfo in image_infos:
+        digest.update(f"{zinfo.file_size}:{zinfo.CRC:08x};".encode("ascii"))
+    return uuid.uuid5(uuid.NAMESPACE_URL, "pic2epub:" + digest.hexdigest())
+
+
+# ========== JPEG 元数据精简 ==========
+# 默认丢弃的段：EXIF/XMP(APP1)、Photoshop(APP13) 等厂商数据和注释。
+# APP0(JFIF)、APP2(ICC 色彩配置) 和 APP14(Adobe，CMYK 解码需要) 默认保留。
+DEFAULT_JPEG_STRIP_SEGMENTS = tuple(
+    [f"APP{n}" for n in (1, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 15)] + ["COM"]
+)
+
+
+def _jpeg_marker_codes(segment_names):
+    """把 'APP1'、'COM' 这样的段名转换为标记码"""
+    codes = set()
+    for name in segment_names:
+        name = name.upper()
+        if name == "COM":
+            codes.add(0xFE)
+        elif name.startswith("APP") and name[3:].isdigit() and 0 <= int(name[3:]) <= 15:
+            codes.add(0xE0 + int(name[3:]))
+        else:
+            raise ValueError(f"Unknown JPEG segment: {name}")
+    return codes
+
+
+def _exif_orientation(payload):
+    """从 APP1 EXIF 数据中读取方向标记，不存在时返回 None"""
+    import struct
+
+    if not payload.startswith(b"Exif\x00\x00") or len(payload) < 14:
+        return None
+    tiff = payload[6:]
+    order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if order is None:
+        return None
+    try:
+        ifd_offset = struct.unpack(order + "I", tiff[4:8])[0]
+        count = struct.unpack(order + "H", tiff[ifd_offset:ifd_offset + 2])[0]
+        for i in range(count):
+            entry = tiff[ifd_offset + 2 + i * 12:ifd_offset + 14 + i * 12]
+            tag, = struct.unpack(order + "H", entry[:2])
+            if tag == 0x0112:
+                return struct.unpack(order + "H", entry[8:10])[0]
+    except struct.error:
+        return None
+    return None
+
+
+def _copy_stream(src, dst, stop_event=None):
+    """按固定大小分块复制剩余数据"""
+    while True:
+        _check_cancelled(stop_event)
+        chunk = src.read(COPY_CHUNK_SIZE)
+        if not chunk:
+            return
+        dst.write(chunk)
+
+
+def strip_jpeg_metadata(src, dst, segment_names=DEFAULT_JPEG_STRIP_SEGMENTS, stop_event=None):
+    """在标记层面流式重写 JPEG，丢弃指定的 APPn/COM 段，不解码像素
+
+    只解析 SOS 之前的段头，扫描数据原样复制。带有非默认方向的 EXIF 段会被保留，
+    以免页面被错误旋转。非 JPEG 或结构异常的数据会原样复制。
+    """
+    drop = _jpeg_marker_codes(segment_names)
+
+    head = src.read(2)
+    dst.write(head)
+    if head != b"\xff\xd8":
+        _copy_stream(src, dst, stop_event)
+        return
+
+    while True:
+        prefix = src.read(1)
+        if not prefix:
+            return
+        if prefix != b"\xff":
+            # 结构异常，剩余部分原样复制
+            dst.write(prefix)
+            _copy_stream(src, dst, stop_event)
+            return
+        marker = src.read(1)
+        while marker == b"\xff":  # 填充字节
+            marker = src.read(1)
+        if not marker:
+            dst.write(prefix)
+            return
+        code = marker[0]
+
+        # 没有长度字段的独立标记
+        if code == 0xD8 or code == 0x01 or 0xD0 <= code <= 0xD7:
+            dst.write(prefix + marker)
+            continue
+
+        length_bytes = src.read(2)
+        if len(length_bytes) < 2:
+            dst.write(prefix + marker + length_bytes)
+            return
+        length = (length_bytes[0] << 8) | length_bytes[1]
+
+        if code == 0xDA or code == 0xD9:
+            # 扫描开始（或图像结束）：之后的数据全部原样复制
+            dst.write(prefix + marker + length_bytes)
+            _copy_stream(src, dst, stop_event)
+            return
+
+        payload = src.read(max(0, length - 2))
+        if code in drop:
+            if not (code == 0xE1 and _exif_orientation(payload) not in (None, 1)):
+                continue
+        dst.write(prefix + marker + length_bytes + payload)
+
+
+# ========== 图片完整性检查 ==========
+# 每个进程池任务检查的文件数，减少进程间通信的开销
+VERIFY_BATCH_SIZE = 64
+
+
+def sniff_image_type(head):
+    """根据文件头的魔数判断图片的媒体类型，无法识别时返回 None"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:2] == b"BM":
+        return "image/bmp"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if head.lstrip().startswith((b"<?xml", b"<svg")):
+        return "image/svg+xml"
+    return None
+
+
+def check_image_file(path, full=False):
+    """检查一张图片的文件头和结束标记，返回问题描述；完好时返回 None
+
+    JPEG 检查 EOI，PNG 检查 IEND，GIF 检查结束符，WebP/BMP 检查声明的长度。
+    full 为 True 时再用 Pillow 的 verify() 和完整解码检查。
+    """
+    import struct
+
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return "empty file"
+            head = f.read(32)
+            f.seek(max(0, size - 1024))
+            tail = f.read()
+    except OSError as e:
+        return f"unreadable: {e}"
+
+    media_type = sniff_image_type(head)
+    if media_type is None:
+        return "unrecognized image header"
+    if media_type == "image/jpeg" and b"\xff\xd9" not in tail:
+        return "truncated JPEG (missing EOI marker)"
+    if media_type == "image/png" and b"IEND\xaeB`\x82" not in tail[-64:]:
+        return "truncated PNG (missing IEND chunk)"
+    if media_type == "image/gif" and not tail.rstrip(b"\x00").endswith(b"\x3b"):
+        return "truncated GIF (missing trailer)"
+    if media_type == "image/webp" and struct.unpack("<I", head[4:8])[0] + 8 > size:
+        return "truncated WebP (RIFF size exceeds file size)"
+    if media_type == "image/bmp" and len(head) >= 6 and struct.unpack("<I", head[2:6])[0] > size:
+        return "truncated BMP (declared size exceeds file size)"
+
+    if full and media_type != "image/svg+xml":
+        from PIL import Image
+        try:
+            with Image.open(path) as im:
+                im.verify()
+            with Image.open(path) as im:
+                im.load()
+        except Exception as e:
+            return f"decode failed: {e}"
+    return None
+
+
+def _check_image_batch(task):
+    paths, full = task
+    return [check_image_file(path, full) for path in paths]
+
+
+def verify_images(image_paths, full=False, workers=None, stop_event=None, progress_callback=None):
+    """在进程池中检查所有图片，返回 [(路径, 问题描述)] 报告"""
+    batches = [image_paths[i:i + VERIFY_BATCH_SIZE] for i in range(0, len(image_paths), VERIFY_BATCH_SIZE)]
+    results = _parallel_map(_check_image_batch, [(batch, full) for batch in batches], workers, stop_event, progress_callback)
+    problems = []
+    for batch, batch_results in zip(batches, results):
+        problems.extend((path, problem) for path, problem in zip(batch, batch_results) if problem)
+    return problems
+
+
+def format_integrity_report(problems):
+    return "\n".join(f"{path}: {problem}" for path, problem in problems)
+
+
+def _placeholder_png(width=600, height=800, gray=0xC0):
+    """生成一张纯灰色的 PNG，用于替换损坏的页面"""
+    import struct
+    import zlib
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    raw = (b"\x00" + bytes([gray]) * width) * height
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 9))
+            + chunk(b"IEND", b""))
+
+
+def apply_integrity_policy(image_paths, problems, policy, staging_dir=None):
+    """按策略处理损坏的图片，返回新的页面列表；策略为 "fail" 时抛出 ValueError"""
+    if not problems:
+        return image_paths
+    report = format_integrity_report(problems)
+    if policy == "fail":
+        raise ValueError(f"Corrupt images found:\n{report}")
+    if policy not in ("skip", "placeholder"):
+        raise ValueError(f"Unknown bad_image_policy: {policy}")
+
+    action = "skipped" if policy == "skip" else "replaced with placeholders"
+    sys.stderr.write(f"[pic2epub] {len(problems)} corrupt image(s) {action}:\n{report}\n")
+    bad = {path for path, _ in problems}
+    if policy == "skip":
+        return [path for path in image_paths if path not in bad]
+
+    placeholder = os.path.join(staging_dir, "placeholder.png")
+    with open(placeholder, "wb") as f:
+        f.write(_placeholder_png())
+    return [placeholder if path in bad else path for path in image_paths]
+
+
+# ========== 图片处理阶段 ==========
+def _require_numpy():
+    """导入 numpy；图片处理阶段需要它"""
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("numpy is required for image optimization (pip install numpy)")
+    return numpy
+
+
+# 按进程数共享的进程池，整个运行（或服务器）期间复用，避免每本书每个阶段都重新启动工作进程
+# 字典按最近使用的顺序排列，_process_pool_users 记录每个进程池正在使用它的调用数
+_process_pools = {}
+_process_pool_users = {}
+_process_pools_lock = threading.Lock()
+# 没有调用在使用时最多保留的进程池数量，更早用过的空闲进程池会被关闭
+MAX_IDLE_PROCESS_POOLS = 1
+
+
+def _acquire_process_pool(workers):
+    """取得 workers 个进程的共享进程池，用完后调用 _release_process_pool 归还
+
+    工作进程用 forkserver（不支持时用 spawn）启动，不从多线程的 GUI/服务器进程中 fork。
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    with _process_pools_lock:
+        executor = _process_pools.pop(workers, None)
+        if executor is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method))
+        _process_pools[workers] = executor
+        _process_pool_users[workers] = _process_pool_users.get(workers, 0) + 1
+        return executor
+
+
+def _release_process_pool(workers, executor, broken=False):
+    """归还共享进程池；已损坏（工作进程异常退出）的进程池被丢弃，下次使用时重建"""
+    retired = [executor] if broken else []
+    with _process_pools_lock:
+        if _process_pools.get(workers) is executor:
+            _process_pool_users[workers] -= 1
+            if broken:
+                del _process_pools[workers]
+                del _process_pool_users[workers]
+        idle = [w for w in _process_pools if not _process_pool_users[w]]
+        for w in idle[:max(0, len(idle) - MAX_IDLE_PROCESS_POOLS)]:
+            retired.append(_process_pools.pop(w))
+            del _process_pool_users[w]
+    for old in retired:
+        old.shutdown(wait=False)
+
+
+def shutdown_process_pools():
+    """关闭所有共享进程池，在运行结束或服务器退出时调用"""
+    with _process_pools_lock:
+        executors = list(_process_pools.values())
+        _process_pools.clear()
+        _process_pool_users.clear()
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+
+def _parallel_map(func, tasks, workers=None, stop_event=None, progress_callback=None):
+    """在共享进程池中执行 func(task)，按任务顺序返回结果
+
+    提交的任务数量有上限，stop_event 被设置后会取消未开始的任务，等正在执行的任务结束后抛出 InterruptedError。
+    单进程或只有一个任务时直接在当前进程执行。
+    """
+    from concurrent.futures import wait, FIRST_COMPLETED
+    from concurrent.futures.process import BrokenProcessPool
+
+    tasks = list(tasks)
+    workers = max(1, workers or os.cpu_count() or 1)
+    results = [None] * len(tasks)
+
+    if workers == 1 or len(tasks) <= 1:
+        for i, task in enumerate(tasks):
+            if stop_event and stop_event.is_set():
+                raise InterruptedError("User cancelled")
+            results[i] = func(task)
+            if progress_callback:
+                progress_callback(i + 1, len(tasks))
+        return results
+
+    executor = _acquire_process_pool(workers)
+    broken = False
+    pending = {}
+    next_index = 0
+    finished = 0
+    try:
+        while next_index < len(tasks) or pending:
+            while next_index < len(tasks) and len(pending) < workers * 2:
+                pending[executor.submit(func, tasks[next_index])] = next_index
+                next_index += 1
+            done, _ = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            if stop_event and stop_event.is_set():
+                raise InterruptedError("User cancelled")
+            for future in done:
+                results[pending.pop(future)] = future.result()
+                finished += 1
+                if progress_callback:
+                    progress_callback(finished, len(tasks))
+    except BrokenProcessPool:
+        broken = True
+        raise
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        # 进程池是共享的，不能靠关闭它来等待；等本次已开始的任务结束，调用方才能安全清理临时文件
+        wait(pending)
+        raise
+    finally:
+        _release_process_pool(workers, executor, broken)
+    return results
+
+
+def _total_size(paths):
+    """文件总字节数，用于统计图片处理阶段的读取量"""
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def _cover_paths(image_paths):
+    """按所在文件夹分别用 get_cover_file 找出封面，返回封面路径集合"""
+    by_folder = {}
+    for path in image_paths:
+        by_folder.setdefault(os.path.dirname(path), []).append(path)
+    covers = set()
+    for folder, paths in by_folder.items():
+        cover = get_cover_file([os.path.basename(path) for path in paths])
+        if cover:
+            covers.add(os.path.join(folder, cover))
+    return covers
+
+
+def _staged_path(staging_dir, index, suffix):
+    return os.path.join(staging_dir, f"page_{index:05d}{suffix}")
+
+
+def _find_content_box(preview, tolerance):
+    """在缩小的灰度预览上用行/列归约找出内容区域，返回 (left, top, right, bottom) 或 None"""
+    np = _require_numpy()
+
+    arr = np.asarray(preview, dtype=np.int16)
+    # 用四条边的中位数作为背景亮度（白边或黑边）
+    border = np.concatenate([arr[0], arr[-1], arr[:, 0], arr[:, -1]])
+    background = int(np.median(border))
+    content = np.abs(arr - background) > tolerance
+    # 忽略零星噪点：一行/一列中至少有 0.5% 的像素是内容
+    rows = np.flatnonzero(content.mean(axis=1) > 0.005)
+    cols = np.flatnonzero(content.mean(axis=0) > 0.005)
+    if rows.size == 0 or cols.size == 0:
+        return None
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def _autocrop_page(task):
+    """裁掉一页的空白边距，返回新文件路径；不需要裁剪时返回 None"""
+    src, dst_stem, tolerance, max_ratio, jpegtran = task
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as im:
+        fmt = im.format
+        width, height = im.size
+        if fmt not in ("JPEG", "PNG", "WEBP"):
+            return None
+        # 裁剪框按显示方向计算，方向标记为 5~8 时宽高互换
+        orientation = im.getexif().get(0x0112)
+        # JPEG 可以直接按 1/8 比例解码，快速得到预览
+        im.draft("L", (max(1, width // 8), max(1, height // 8)))
+        preview = ImageOps.exif_transpose(im).convert("L")
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+    preview.thumbnail((512, 512))
+
+    box = _find_content_box(preview, tolerance)
+    if box is None:
+        return None
+    sx = width / preview.width
+    sy = height / preview.height
+    # 映射回原图并多留一个预览像素的边距
+    left = max(0, int((box[0] - 1) * sx))
+    top = max(0, int((box[1] - 1) * sy))
+    right = min(width, int((box[2] + 1) * sx + 0.999))
+    bottom = min(height, int((box[3] + 1) * sy + 0.999))
+
+    # 安全上限：某个方向裁掉太多时不裁剪该方向
+    if width - (right - left) > max_ratio * width:
+        left, right = 0, width
+    if height - (bottom - top) > max_ratio * height:
+        top, bottom = 0, height
+    if (right - left) > 0.99 * width and (bottom - top) > 0.99 * height:
+        return None
+
+    suffix = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}[fmt]
+    dst = dst_stem + suffix
+    # jpegtran 按存储方向裁剪，只用于没有方向标记的 JPEG
+    if fmt == "JPEG" and jpegtran and orientation in (None, 1):
+        import subprocess
+
+        # 无损裁剪：jpegtran 会把左上角对齐到 MCU 边界
+        crop = f"{right - left}x{bottom - top}+{left}+{top}"
+        result = subprocess.run([jpegtran, "-crop", crop, "-copy", "all", "-outfile", dst, src],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode == 0 and os.path.exists(dst):
+            return dst
+
+    with Image.open(src) as im:
+        # 裁剪结果不带 EXIF 保存，先按方向标记旋转再裁剪
+        cropped = ImageOps.exif_transpose(im).crop((left, top, right, bottom))
+        save_args = {}
+        if im.info.get("icc_profile"):
+            save_args["icc_profile"] = im.info["icc_profile"]
+        if fmt == "JPEG":
+            from PIL import JpegImagePlugin
+            # 沿用原图的量化表和色度采样，尽量保持原有画质
+            save_args["qtables"] = im.quantization
+            save_args["subsampling"] = JpegImagePlugin.get_sampling(im)
+            if cropped.mode not in ("L", "RGB", "CMYK"):
+                cropped = cropped.convert("RGB")
+        elif fmt == "WEBP":
+            save_args["lossless"] = True
+        cropped.save(dst, fmt, **save_args)
+    return dst
+
+
+def autocrop_pages(image_paths, staging_dir, options, stop_event=None, progress_callback=None):
+    """自动裁边阶段：裁掉扫描件四周的空白/黑边，返回新的页面路径列表"""
+    import shutil
+
+    _require_numpy()
+    jpegtran = shutil.which("jpegtran")
+    tasks = [
+        (path, _staged_path(staging_dir, i, ".crop"), options.autocrop_tolerance, options.autocrop_max_ratio, jpegtran)
+        for i, path in enumerate(image_paths)
+    ]
+    results = _parallel_map(_autocrop_page, tasks, options.workers, stop_event, progress_callback)
+    return [result or path for path, result in zip(image_paths, results)]
+
+
+# 长图按该行数分带分析，限制 numpy 临时数组的大小（不限制解码本身占用的内存）
+SLICE_BAND_ROWS = 1024
+
+
+def _find_slice_cuts(row_std, width, target_ratio, tolerance, gutter_std):
+    """根据每行的标准差选择切割位置：在目标高度附近优先切在空白间隙上"""
+    np = _require_numpy()
+
+    height = len(row_std)
+    target = max(1, int(width * target_ratio))
+    gutter = row_std <= gutter_std
+    cuts = []
+    y = 0
+    while height - y > target * (1 + tolerance):
+        ideal = y + target
+        lo = y + max(1, int(target * (1 - tolerance)))
+        hi = min(height - 1, y + int(target * (1 + tolerance)))
+        candidates = np.flatnonzero(gutter[lo:hi]) + lo
+        # 取离理想位置最近的间隙行，找不到间隙时直接在目标高度处切开
+        cut = int(candidates[np.argmin(np.abs(candidates - ideal))]) if candidates.size else ideal
+        cuts.append(cut)
+        y = cut
+    return cuts
+
+
+def _slice_strip(task):
+    """把一张长图切成多页，返回切片路径列表；不是长图时返回 None
+
+    整张长图会被一次性完整解码到内存（约 宽×高×通道数 字节），分析和裁切都复用这份数据；
+    Pillow 无法按行带增量解码 PNG/JPEG，分带只限制了 numpy 临时数组的大小。
+    """
+    src, dst_stem, min_ratio, target_ratio, tolerance, gutter_std = task
+    np = _require_numpy()
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as original:
+        width, height = original.size
+        # 按显示方向判断是否为长图，方向标记为 5~8 时宽高互换
+        orientation = original.getexif().get(0x0112)
+        if orientation in (5, 6, 7, 8):
+            width, height = height, width
+        if height < min_ratio * width:
+            return None
+        fmt = original.format
+        # 切片不带 EXIF 保存，有方向标记时先旋转
+        im = ImageOps.exif_transpose(original) if orientation not in (None, 1) else original
+        im.load()
+
+        # 分带计算每行的标准差
+        row_std = np.empty(height, dtype=np.float32)
+        for y0 in range(0, height, SLICE_BAND_ROWS):
+            y1 = min(height, y0 + SLICE_BAND_ROWS)
+            band = np.asarray(im.crop((0, y0, width, y1)).convert("L"), dtype=np.float32)
+            row_std[y0:y1] = band.std(axis=1)
+
+        cuts = _find_slice_cuts(row_std, width, target_ratio, tolerance, gutter_std)
+        if not cuts:
+            return None
+
+        # 逐片保存，每次只持有一片的数据
+        save_args = {}
+        if original.info.get("icc_profile"):
+            save_args["icc_profile"] = original.info["icc_profile"]
+        if fmt == "JPEG":
+            from PIL import JpegImagePlugin
+            suffix = ".jpg"
+            save_args["qtables"] = original.quantization
+            save_args["subsampling"] = JpegImagePlugin.get_sampling(original)
+        else:
+            fmt, suffix = "PNG", ".png"
+
+        slices = []
+        bounds = [0] + cuts + [height]
+        for index, (top, bottom) in enumerate(zip(bounds, bounds[1:])):
+            piece = im.crop((0, top, width, bottom))
+            if fmt == "JPEG" and piece.mode not in ("L", "RGB", "CMYK"):
+                piece = piece.convert("RGB")
+            dst = f"{dst_stem}_{index:03d}{suffix}"
+            piece.save(dst, fmt, **save_args)
+            slices.append(dst)
+    return slices
+
+
+def slice_strip_pages(image_paths, staging_dir, options, stop_event=None, progress_callback=None):
+    """条漫切分阶段：返回与 image_paths 一一对应的列表，每项是该图切出的页面路径列表
+
+    每个工作进程会完整解码它正在处理的长图，峰值内存约为 workers 张长图解码后的大小。
+    """
+    _require_numpy()
+    tasks = [
+        (path, _staged_path(staging_dir, i, ".slice"), options.slice_min_ratio, options.slice_target_ratio,
+         options.slice_tolerance, options.slice_gutter_std)
+        for i, path in enumerate(image_paths)
+    ]
+    results = _parallel_map(_slice_strip, tasks, options.workers, stop_event, progress_callback)
+    return [result or [path] for path, result in zip(image_paths, results)]
+
+
+def _grayscale_page(task):
+    """检测并转换一页：实际为黑白的彩色页面转为灰度，返回新文件路径；不需要转换时返回 None"""
+    src, dst_stem, tolerance, max_color_ratio, png_bits, jpeg_quality = task
+    np = _require_numpy()
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as im:
+        fmt = im.format
+        if fmt not in ("JPEG", "PNG") or im.mode not in ("RGB", "RGBA", "P", "CMYK", "YCbCr"):
+            return None
+        qtables = getattr(im, "quantization", None)
+        # 重新保存时不带 EXIF，先按方向标记旋转
+        rgba = ImageOps.exif_transpose(im).convert("RGBA")
+
+    arr = np.asarray(rgba)
+    # 有透明像素的页面保持原样
+    if arr[..., 3].min() < 255:
+        return None
+    # 隔行隔列采样后计算每个像素的通道最大差
+    sample = arr[::2, ::2, :3].astype(np.int16)
+    spread = sample.max(axis=2) - sample.min(axis=2)
+    if np.count_nonzero(spread > tolerance) > max_color_ratio * spread.size:
+        return None
+
+    gray = rgba.convert("L")
+    if fmt == "JPEG":
+        dst = dst_stem + ".jpg"
+        if jpeg_quality == "keep" and qtables:
+            gray.save(dst, "JPEG", qtables=[qtables[0]], optimize=True)
+        else:
+            gray.save(dst, "JPEG", quality=90 if jpeg_quality == "keep" else int(jpeg_quality), optimize=True)
+    elif png_bits == 4:
+        # 量化为 16 级灰度调色板
+        levels = (np.asarray(gray, dtype=np.uint16) * 15 + 127) // 255
+        paletted = Image.fromarray(levels.astype(np.uint8), "P")
+        paletted.putpalette([v for i in range(16) for v in (i * 17,) * 3])
+        dst = dst_stem + ".png"
+        paletted.save(dst, "PNG", bits=4, optimize=True)
+    else:
+        dst = dst_stem + ".png"
+        gray.save(dst, "PNG", optimize=True)
+
+    # 转换后没有变小就保留原图
+    if os.path.getsize(dst) >= os.path.getsize(src):
+        os.remove(dst)
+        return None
+    return dst
+
+
+def convert_grayscale_pages(image_paths, staging_dir, options, stop_event=None, progress_callback=None, covers=None):
+    """灰度优化阶段：把实际为黑白的页面转为单通道灰度，封面保持不变，返回新的页面路径列表
+
+    covers 为封面路径集合，默认用 get_cover_file 从 image_paths 中查找。
+    """
+    _require_numpy()
+    if covers is None:
+        covers = _cover_paths(image_paths)
+    indexes = [i for i, path in enumerate(image_paths) if path not in covers]
+    tasks = [
+        (image_paths[i], _staged_path(staging_dir, i, ".gray"), options.grayscale_tolerance,
+         options.grayscale_max_color_ratio, options.grayscale_png_bits, options.grayscale_jpeg_quality)
+        for i in indexes
+    ]
+    results = _parallel_map(_grayscale_page, tasks, options.workers, stop_event, progress_callback)
+    new_paths = list(image_paths)
+    for i, result in zip(indexes, results):
+        if result:
+            new_paths[i] = result
+    return new_paths
+
+
+# ========== 跨页拆分 ==========
+# JPEG 中带有尺寸信息的 SOF 标记（排除 DHT、JPG、DAC）
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def probe_image_size(path):
+    """只读取文件头获取图片尺寸 (宽, 高)，支持 PNG、JPEG、GIF、WebP，其他格式交给 Pillow；失败时返回 None"""
+    import struct
+
+    try:
+        with open(path, "rb") as f:
+            head = f.read(32)
+            kind = sniff_image_type(head)
+            if kind == "image/png" and head[12:16] == b"IHDR":
+                return struct.unpack(">II", head[16:24])
+            if kind == "image/gif":
+                return struct.unpack("<HH", head[6:10])
+            if kind == "image/webp":
+                chunk = head[12:16]
+                if chunk == b"VP8 " and head[23:26] == b"\x9d\x01\x2a":
+                    width, height = struct.unpack("<HH", head[26:30])
+                    return width & 0x3FFF, height & 0x3FFF
+                if chunk == b"VP8L" and head[20:21] == b"\x2f":
+                    bits = int.from_bytes(head[21:25], "little")
+                    return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+                if chunk == b"VP8X":
+                    return int.from_bytes(head[24:27], "little") + 1, int.from_bytes(head[27:30], "little") + 1
+            if kind == "image/jpeg":
+                # 顺着段长度跳到第一个 SOF 段
+                f.seek(2)
+                while True:
+                    byte = f.read(1)
+                    if not byte:
+                        break
+                    if byte != b"\xff":
+                        continue
+                    marker = f.read(1)
+                    while marker == b"\xff":
+                        marker = f.read(1)
+                    if not marker:
+                        break
+                    code = marker[0]
+                    if code == 0x01 or 0xD0 <= code <= 0xD9:
+                        continue
+                    length_bytes = f.read(2)
+                    if len(length_bytes) < 2:
+                        break
+                    length, = struct.unpack(">H", length_bytes)
+                    if code in JPEG_SOF_MARKERS:
+                        data = f.read(5)
+                        if len(data) == 5:
+                            height, width = struct.unpack(">HH", data[1:5])
+                            return width, height
+                        break
+                    f.seek(length - 2, os.SEEK_CUR)
+    except OSError:
+        return None
+
+    try:
+        from PIL import Image
+        with Image.open(path) as im:
+            return im.size
+    except Exception:
+        return None
+
+
+def _find_spread_gutter(preview):
+    """在预览图中间 10% 的范围内找出像素标准差最小的列作为跨页的中缝，返回其相对位置
+
+    空白中缝通常有很多列同样平坦，取其中离正中间最近的一列。
+    """
+    np = _require_numpy()
+
+    arr = np.asarray(preview, dtype=np.float32)
+    width = arr.shape[1]
+    lo, hi = int(width * 0.45), max(int(width * 0.45) + 1, int(width * 0.55))
+    col_std = arr[:, lo:hi].std(axis=0)
+    candidates = np.flatnonzero(col_std <= col_std.min() + 1.0) + lo
+    return (int(candidates[np.argmin(np.abs(candidates - width / 2))]) + 0.5) / width
+
+
+def _split_spread(task):
+    """把一张跨页拆成两页，返回按阅读顺序排列的 [(路径, "left"/"right")]；不适合拆分时返回 None"""
+    src, dst_stem, right_to_left, jpegtran = task
+    from PIL import Image
+
+    with Image.open(src) as im:
+        fmt = im.format
+        width, height = im.size
+        # 带旋转标记的图片按存储方向无法判断左右，保持原样
+        if im.getexif().get(0x0112, 1) != 1:
+            return None
+        im.draft("L", (max(1, width // 8), max(1, height // 8)))
+        preview = im.convert("L")
+    preview.thumbnail((1024, 1024))
+    cut = int(round(_find_spread_gutter(preview) * width))
+
+    with Image.open(src) as im:
+        save_args = {}
+        if im.info.get("icc_profile"):
+            save_args["icc_profile"] = im.info["icc_profile"]
+        if fmt == "JPEG":
+            from PIL import JpegImagePlugin
+            suffix = ".jpg"
+            sampling = JpegImagePlugin.get_sampling(im)
+            save_args["qtables"] = im.quantization
+            save_args["subsampling"] = sampling
+            # 对齐到 MCU 宽度，jpegtran 才能无损拆分
+            mcu = 8 if im.mode == "L" or sampling == 0 else 16
+            cut = max(mcu, min(width - mcu, int(round(cut / mcu)) * mcu))
+        else:
+            fmt, suffix = "PNG", ".png"
+
+        halves = {"left": (0, cut), "right": (cut, width)}
+        pages = []
+        for side in (("right", "left") if right_to_left else ("left", "right")):
+            x0, x1 = halves[side]
+            dst = f"{dst_stem}_{side}{suffix}"
+            if fmt == "JPEG" and jpegtran:
+                import subprocess
+
+                crop = f"{x1 - x0}x{height}+{x0}+0"
+                result = subprocess.run([jpegtran, "-crop", crop, "-copy", "all", "-outfile", dst, src],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                if result.returncode == 0 and os.path.exists(dst):
+                    pages.append((dst, side))
+                    continue
+            piece = im.crop((x0, 0, x1, height))
+            if fmt == "JPEG" and piece.mode not in ("L", "RGB", "CMYK"):
+                piece = piece.convert("RGB")
+            piece.save(dst, fmt, **save_args)
+            pages.append((dst, side))
+    return pages
+
+
+def split_spread_pages(image_paths, staging_dir, options, stop_event=None, progress_callback=None, covers=()):
+    """跨页拆分阶段：按文件头中的尺寸找出跨页，在进程池中拆成两页
+
+    返回 (与 image_paths 一一对应的页面路径列表的列表, {拆出的页面路径: "left"/"right"})。
+    封面不拆分。
+    """
+    import shutil
+
+    _require_numpy()
+    spreads = []
+    for i, path in enumerate(image_paths):
+        if stop_event and stop_event.is_set():
+            raise InterruptedError("User cancelled")
+        size = probe_image_size(path)
+        if path not in covers and size and size[1] and size[0] >= options.spread_min_ratio * size[1]:
+            spreads.append(i)
+
+    jpegtran = shutil.which("jpegtran")
+    tasks = [(image_paths[i], _staged_path(staging_dir, i, ".spread"), options.right_to_left, jpegtran) for i in spreads]
+    results = _parallel_map(_split_spread, tasks, options.workers, stop_event, progress_callback)
+
+    pages = [[path] for path in image_paths]
+    sides = {}
+    for i, result in zip(spreads, results):
+        if result:
+            pages[i] = [path for path, _side in result]
+            sides.update(result)
+    return pages, sides
+
+
+# ========== 目标大小 ==========
+# 抽样估算时尝试的画质
+SIZE_QUALITY_GRID = (30, 40, 50, 60, 70, 80, 90, 95)
+# 大小超出预算时最多重新调整的轮数
+SIZE_FIT_ROUNDS = 2
+SIZE_UNITS = {"": 1, "B": 1, "K": 1000, "KB": 1000, "KIB": 1024, "M": 1000 ** 2, "MB": 1000 ** 2,
+              "MIB": 1024 ** 2, "G": 1000 ** 3, "GB": 1000 ** 3, "GIB": 1024 ** 3}
+
+
+def parse_size(value):
+    """把 200000000、"200MB"、"1.5GiB" 这样的大小转换为字节数"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    match = re.fullmatch(r"\s*([\d.]+)\s*([A-Za-z]*)\s*", str(value))
+    if not match or match.group(2).upper() not in SIZE_UNITS:
+        raise ValueError(f"Invalid size: {value!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).upper()])
+
+
+def _open_for_jpeg(path):
+    """打开图片并转换为可以编码为 JPEG 的模式；带透明通道或无法打开时返回 None"""
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(path) as im:
+            if im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info:
+                return None
+            icc_profile = im.info.get("icc_profile")
+            im = ImageOps.exif_transpose(im)
+            converted = im.convert("L" if im.mode in ("1", "L", "I", "I;16") else "RGB")
+            # 保留颜色配置文件；CMYK 等转换到其他色彩空间后原配置文件不再适用
+            converted.info.pop("icc_profile", None)
+            if icc_profile and im.mode not in ("CMYK", "YCbCr", "LAB"):
+                converted.info["icc_profile"] = icc_profile
+            return converted
+    except Exception:
+        return None
+
+
+def _encode_jpeg(im, quality):
+    import io
+
+    save_args = {}
+    if im.info.get("icc_profile"):
+        save_args["icc_profile"] = im.info["icc_profile"]
+    buffer = io.BytesIO()
+    im.save(buffer, "JPEG", quality=quality, optimize=True, **save_args)
+    return buffer.getvalue()
+
+
+def _sample_quality_curve(task):
+    """把一页按 qualities 中的每个画质编码，返回各自的字节数；无法编码时返回 None"""
+    path, qualities = task
+    im = _open_for_jpeg(path)
+    if im is None:
+        return None
+    return [len(_encode_jpeg(im, q)) for q in qualities]
+
+
+def _fit_page(task):
+    """二分查找不超过 budget 的最高画质并写出，返回 (路径, 字节数, 画质)"""
+    src, dst, budget, low, high = task
+    im = _open_for_jpeg(src)
+    if im is None:
+        return src, os.path.getsize(src), None
+    best_quality, best = low, _encode_jpeg(im, low)
+    while low < high and len(best) <= budget:
+        quality = (low + high + 1) // 2
+        data = _encode_jpeg(im, quality)
+        if len(data) <= budget:
+            best_quality, best, low = quality, data, quality
+        else:
+            high = quality - 1
+    with open(dst, "wb") as f:
+        f.write(best)
+    return dst, len(best), best_quality
+
+
+def _quality_for(options, path, covers):
+    """页面允许的画质范围，封面的下限可以更高"""
+    low, high = options.size_min_quality, options.size_max_quality
+    if path in covers and options.cover_min_quality is not None:
+        low = min(high, max(low, options.cover_min_quality))
+    return low, high
+
+
+def plan_size_budget(image_paths, options, stop_event=None, covers=()):
+    """抽样估算各画质下的大小，按预算为每页分配字节数
+
+    返回 (每页预算列表（None 表示保留原图）, 预计的 EPUB 大小, 估算的统一画质)。
+    预算按各页在统一画质下的预计大小成比例分配（注水法）：
+    原图已经不超过分配额度的页面直接保留，省下的额度再分给其余页面。
+    """
+    target = parse_size(options.target_size)
+    sizes = [os.path.getsize(path) for path in image_paths]
+    overhead = estimate_archive(image_paths)[1] - sum(sizes)
+    budget = target - overhead
+    if sum(sizes) <= budget:
+        return [None] * len(image_paths), overhead + sum(sizes), None
+
+    # 按媒体类型分别抽样：同类原图的大小可以代表页面的复杂程度
+    qualities = [q for q in SIZE_QUALITY_GRID if options.size_min_quality <= q <= options.size_max_quality]
+    qualities = sorted(set(qualities) | {options.size_min_quality, options.size_max_quality})
+    groups = {}
+    for i, path in enumerate(image_paths):
+        groups.setdefault(get_image_media_type(path), []).append(i)
+    per_group = max(1, options.size_sample_pages // len(groups))
+    samples = []
+    for indexes in groups.values():
+        step = max(1, len(indexes) // per_group)
+        samples.extend(indexes[::step][:per_group])
+    curves = _parallel_map(_sample_quality_curve, [(image_paths[i], qualities) for i in samples],
+                           options.workers, stop_event)
+
+    # 每种媒体类型在各画质下的 编码大小 / 原图大小
+    ratios = {}
+    for media_type, indexes in groups.items():
+        members = set(indexes)
+        pairs = [(sizes[i], curve) for i, curve in zip(samples, curves) if curve and i in members]
+        if pairs:
+            source = sum(size for size, _ in pairs)
+            ratios[media_type] = [sum(curve[k] for _, curve in pairs) / source for k in range(len(qualities))]
+
+    def predicted(i, k):
+        """第 i 页在第 k 个画质（封面不低于下限）下的预计大小；无法重新编码的页面保持原大小"""
+        ratio = ratios.get(get_image_media_type(image_paths[i]))
+        if ratio is None:
+            return sizes[i]
+        low = _quality_for(options, image_paths[i], covers)[0]
+        k = max(k, next((j for j, q in enumerate(qualities) if q >= low), k))
+        return sizes[i] * ratio[k]
+
+    # 找出整本书放得下的最高统一画质
+    level = 0
+    for k in range(len(qualities)):
+        if sum(predicted(i, k) for i in range(len(image_paths))) <= budget:
+            level = k
+    weights = [predicted(i, level) for i in range(len(image_paths))]
+
+    # 注水分配：原图放得下的页面保留，剩余预算按权重分给其他页面
+    budgets = [None] * len(image_paths)
+    active = set(range(len(image_paths)))
+    remaining = budget
+    while active:
+        total_weight = sum(weights[i] for i in active)
+        keep = [i for i in active if sizes[i] <= remaining * weights[i] / total_weight
+                or get_image_media_type(image_paths[i]) not in ratios]
+        if not keep:
+            break
+        for i in keep:
+            active.discard(i)
+            remaining -= sizes[i]
+    total_weight = sum(weights[i] for i in active) or 1
+    for i in active:
+        budgets[i] = max(1, int(remaining * weights[i] / total_weight))
+
+    # 二分查找会把每页编码到接近其预算，但不会超过最高画质的大小，也不会低于最低画质的大小
+    top = len(qualities) - 1
+    estimate = overhead + sum(
+        sizes[i] if budgets[i] is None else max(min(budgets[i], predicted(i, top)), predicted(i, 0))
+        for i in range(len(image_paths)))
+    return budgets, int(estimate), qualities[level]
+
+
+def fit_pages_to_size(image_paths, staging_dir, options, stop_event=None, progress_callback=None, covers=None):
+    """目标大小阶段：按预算重新编码页面，使整本书落在 target_size 以内，返回新的页面路径列表
+
+    先抽样预测最终大小并输出，再在进程池中逐页二分查找画质；
+    实际大小仍超出预算时，把超出的部分从还能降低画质的页面中扣除后再调整一轮。
+    """
+    if covers is None:
+        covers = _cover_paths(image_paths)
+    target = parse_size(options.target_size)
+    budgets, estimate, quality = plan_size_budget(image_paths, options, stop_event, covers)
+    if quality is None:
+        return list(image_paths)
+    sys.stderr.write(
+        f"[pic2epub] size budget {target / 1e6:.1f} MB: predicted {estimate / 1e6:.1f} MB "
+        f"at quality ~{quality}\n")
+
+    new_paths = list(image_paths)
+    results = {}
+    todo = [i for i, b in enumerate(budgets) if b is not None]
+    overhead = estimate_archive(image_paths)[1] - sum(os.path.getsize(path) for path in image_paths)
+    for round_index in range(SIZE_FIT_ROUNDS + 1):
+        tasks = [(image_paths[i], _staged_path(staging_dir, i, f".fit{round_index}.jpg"), budgets[i],
+                  *_quality_for(options, image_paths[i], covers)) for i in todo]
+        for i, result in zip(todo, _parallel_map(_fit_page, tasks, options.workers, stop_event, progress_callback)):
+            results[i] = result
+            new_paths[i] = result[0]
+
+        total = overhead + sum(os.path.getsize(path) if i not in results else results[i][1]
+                               for i, path in enumerate(new_paths))
+        excess = total - target
+        # 还能降低画质的页面
+        todo = [i for i in results
+                if results[i][2] is not None and results[i][2] > _quality_for(options, image_paths[i], covers)[0]]
+        if excess <= 0 or not todo:
+            break
+        room = sum(results[i][1] for i in todo)
+        for i in todo:
+            budgets[i] = max(1, int(results[i][1] - excess * results[i][1] / room))
+
+    if total > target:
+        sys.stderr.write(f"[pic2epub] warning: {total / 1e6:.1f} MB exceeds the size budget "
+                         f"even at the minimum quality\n")
+    return new_paths
+
+
+# ========== 打包 ==========
+# 拷贝图片数据时使用的固定缓冲区大小
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def _check_cancelled(stop_event):
+    if stop_event and stop_event.is_set():
+        raise InterruptedError("User cancelled")
+
+
+def _crc32_of_view(view, size, stop_event=None):
+    """分块计算内存映射数据的 CRC32"""
+    import zlib
+
+    crc = 0
+    for offset in range(0, size, COPY_CHUNK_SIZE):
+        _check_cancelled(stop_event)
+        crc = zlib.crc32(view[offset:offset + COPY_CHUNK_SIZE], crc)
+    return crc
+
+
+def _copy_file_data(zf, src, view, size, stop_event=None):
+    """把源文件数据写到 zf 当前位置：优先用内核拷贝，否则用固定小块从 mmap 写出
+
+    每个数据块之间都会检查 stop_event，大文件也能及时取消。
+    """
+    copied = 0
+    if zf._seekable and size:
+        dst = zf.fp
+        dst.flush()
+        start = dst.tell()
+        try:
+            out_fd = dst.fileno()
+        except (AttributeError, OSError, ValueError):
+            out_fd = None
+
+        if out_fd is not None and hasattr(os, 'copy_file_range'):
+            try:
+                while copied < size:
+                    _check_cancelled(stop_event)
+                    n = os.copy_file_range(src.fileno(), out_fd, min(COPY_CHUNK_SIZE, size - copied),
+                                           copied, start + copied)
+                    if n == 0:
+                        break
+                    copied += n
+            except OSError:
+                pass  # 跨文件系统或不支持时退回其他方式
+
+        if out_fd is not None and copied < size and hasattr(os, 'sendfile'):
+            try:
+                os.lseek(out_fd, start + copied, os.SEEK_SET)
+                while copied < size:
+                    _check_cancelled(stop_event)
+                    n = os.sendfile(out_fd, src.fileno(), copied, min(COPY_CHUNK_SIZE, size - copied))
+                    if n == 0:
+                        break
+                    copied += n
+            except OSError:
+                pass
+
+        # 内核直接写了文件描述符，重新同步缓冲文件对象的位置
+        dst.seek(start + copied)
+
+    while copied < size:
+        _check_cancelled(stop_event)
+        n = min(COPY_CHUNK_SIZE, size - copied)
+        zf.fp.write(view[copied:copied + n])
+        copied += n
+
+
+def _append_entry(zf, zinfo, zip64, write_data):
+    """在 zf 末尾写入 CRC 和大小都已知的条目
+
+    本地文件头一次写对，既不需要回写也不需要数据描述符，管道等不可寻址的输出也适用。
+    write_data() 负责在文件头之后写出数据。
+    """
+    with zf._lock:
+        if zf._writing:
+            raise ValueError("Can't write to ZIP archive while an open writing handle exists")
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        zinfo.header_offset = zf.fp.tell()
+        zf.fp.write(zinfo.FileHeader(zip64))
+        write_data()
+        zf.start_dir = zf.fp.tell()
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+
+
+class _FinalizeOnSuccess:
+    """with 块正常结束时才关闭并写出中央目录
+
+    出错或取消时放弃归档：不写中央目录就关闭，写往管道/标准输出的读取方不会得到一个看似完整的截断归档。
+    """
+    def __init__(self, zf):
+        self.zf = zf
+
+    def __enter__(self):
+        return self.zf
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.zf._didModify = False
+        self.zf.close()
+        return False
+
+
+def write_stored_file(zf, src_path, arcname, date_time=None, stop_event=None, force_zip64=False):
+    """以 ZIP_STORED 方式把源文件写入打开的 ZipFile，返回 ZipInfo
+
+    源文件被内存映射，CRC32 直接在映射上分块计算，因此本地文件头写入时已知 CRC，
+    数据再通过 copy_file_range/sendfile 或固定大小缓冲区写出，不会整张读入内存。
+    """
+    import mmap
+    from zipfile import ZipInfo, ZIP_STORED, ZIP64_LIMIT
+
+    zinfo = ZipInfo(arcname, date_time or time.localtime(time.time())[:6])
+    zinfo.compress_type = ZIP_STORED
+    zinfo.external_attr = 0o644 << 16
+
+    with open(src_path, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        mm = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        view = memoryview(mm) if mm is not None else memoryview(b'')
+        try:
+            zinfo.file_size = zinfo.compress_size = size
+            zinfo.CRC = _crc32_of_view(view, size, stop_event)
+            _append_entry(zf, zinfo, force_zip64 or size > ZIP64_LIMIT,
+                          lambda: _copy_file_data(zf, src, view, size, stop_event))
+        finally:
+            view.release()
+            if mm is not None:
+                mm.close()
+    return zinfo
+
+
+def write_filtered_file(zf, src_path, arcname, filter_func, date_time=None, force_zip64=False):
+    """把 filter_func(src, dst) 流式产生的数据以不压缩方式写入 zf，返回 ZipInfo"""
+    from zipfile import ZipInfo, ZIP_STORED, ZIP64_LIMIT
+
+    zinfo = ZipInfo(arcname, date_time or time.localtime(time.time())[:6])
+    zinfo.compress_type = ZIP_STORED
+    zinfo.external_attr = 0o644 << 16
+    with open(src_path, 'rb') as src:
+        # 过滤只会让数据变小，按源文件大小决定是否需要 ZIP64
+        force_zip64 = force_zip64 or os.fstat(src.fileno()).st_size > ZIP64_LIMIT
+        with zf.open(zinfo, 'w', force_zip64=force_zip64) as dst:
+            filter_func(src, dst)
+    return zinfo
+
+
+def _xml_bytes(element):
+    from lxml import etree
+    return etree.tostring(element, pretty_print=True, xml_declaration=True, encoding='UTF-8')
+
+
+def _writestr(zf, arcname, data, force_zip64=False):
+    """以固定时间戳和权限写入不压缩的条目；CRC 预先计算，mimetype 在流式输出中也没有数据描述符"""
+    import zlib
+    from zipfile import ZipInfo, ZIP_STORED
+
+    zinfo = ZipInfo(arcname, FIXED_ZIP_DATE_TIME)
+    zinfo.compress_type = ZIP_STORED
+    zinfo.external_attr = 0o644 << 16
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    zinfo.file_size = zinfo.compress_size = len(data)
+    zinfo.CRC = zlib.crc32(data)
+    _append_entry(zf, zinfo, force_zip64, lambda: zf.fp.write(data))
+
+
+# ========== 大型归档 ==========
+# 传统 ZIP 格式的条目数和大小字段的最大值；该值本身是 ZIP64 的标记值，达到即需要 ZIP64
+ZIP_MAX_ENTRIES = 0xFFFF
+ZIP_MAX_BYTES = 0xFFFFFFFF
+# 每页除图片外的估算开销：XHTML、OPF/NCX 条目以及两个条目的 ZIP 头和中央目录记录
+PAGE_OVERHEAD_ESTIMATE = 1024
+# 除页面外的固定条目：mimetype、container.xml、content.opf、toc.ncx
+FIXED_ENTRY_COUNT = 4
+
+
+def estimate_archive(image_paths):
+    """根据扫描结果估算EPUB的条目数和字节数（只需 stat）"""
+    entries = FIXED_ENTRY_COUNT + 2 * len(image_paths)
+    size = 4096 + sum(os.path.getsize(path) + PAGE_OVERHEAD_ESTIMATE for path in image_paths)
+    return entries, size
+
+
+def exceeds_classic_zip(entries, size):
+    """条目数或字节数是否超出传统 ZIP 的表示范围（0xFFFF/0xFFFFFFFF 是 ZIP64 的标记值，不能作为普通取值）"""
+    return entries >= ZIP_MAX_ENTRIES or size >= ZIP_MAX_BYTES
+
+
+def needs_zip64(image_paths):
+    """估算结果是否超出传统 ZIP 的上限"""
+    return exceeds_classic_zip(*estimate_archive(image_paths))
+
 
-    # 创建mimetype文件
-    with open('mimetype', 'w') as f:
-        f.write('application/epub+zip')
+def plan_volumes(image_paths, options=None, warn=True):
+    """预检大型归档，返回分卷后的页面列表
+
+    只有策略为 "split" 且超出上限时才会分成多卷，每卷都不超过传统 ZIP 的上限；
+    策略为 "warn" 时输出警告并在需要时自动使用 ZIP64。
+    """
+    options = options or ConversionOptions()
+    if options.large_archive not in ("warn", "split", "zip64"):
+        raise ValueError(f"Unknown large_archive policy: {options.large_archive}")
+    if not needs_zip64(image_paths):
+        return [list(image_paths)]
+
+    entries, size = estimate_archive(image_paths)
+    if options.large_archive == "warn" and warn:
+        sys.stderr.write(
+            f"[pic2epub] warning: book has ~{entries} entries / ~{size / 1024 ** 3:.1f} GiB, "
+            f"ZIP64 will be used and some readers may not open it\n")
+    if options.large_archive != "split":
+        return [list(image_paths)]
+
+    max_pages = (ZIP_MAX_ENTRIES - FIXED_ENTRY_COUNT) // 2
+    max_bytes = ZIP_MAX_BYTES - 4096
+    volumes = [[]]
+    volume_bytes = 0
+    for path in image_paths:
+        page_bytes = os.path.getsize(path) + PAGE_OVERHEAD_ESTIMATE
+        if volumes[-1] and (len(volumes[-1]) >= max_pages or volume_bytes + page_bytes > max_bytes):
+            volumes.append([])
+            volume_bytes = 0
+        volumes[-1].append(path)
+        volume_bytes += page_bytes
+    return volumes
+
+
+def create_epub_from_images(image_paths, output_file, book_title, progress_callback=None, stop_event=None, options=None,
+                            write_gate=None):
+    """从图片列表创建EPUB文件
+
+    图片直接从源路径以不压缩方式写入 EPUB，XML 文件在内存中生成，不再需要临时目录。
+    输出是可重复的：固定的条目顺序和时间戳、由内容决定的 UUID，
+    并把输入指纹写入 OPF 和 zip 注释，供下次运行判断是否需要重建。
+
+    progress_callback 可以是 (current, total)，也可以是 (current, total, metrics)：
+    接受第三个参数时会收到 ProgressMetrics，其中的 stage 是流水线实际所处的阶段。
+
+    output_file 可以是路径，也可以是任意可写的二进制流（管道、套接字、标准输出）。
+    写入流时按顺序输出、从不回退：大小未知的条目使用数据描述符，内存占用与书的大小无关；
+    此时不做原子替换，也不做打包后的校验。
+
+    write_gate 为可选的上下文管理器（如信号量），只在写出 EPUB 时持有，
+    用于限制同时写盘的书籍数；扫描和图片处理阶段不受限制。
+    """
+    options = options or ConversionOptions()
+    progress_callback = _metrics_progress(progress_callback)
+    fingerprint = compute_input_fingerprint(image_paths, book_title, options)
+    to_path = isinstance(output_file, (str, os.PathLike))
+
+    # 启用的阶段按顺序执行，每个阶段在整体进度中占相同的比例
+    phases = [name for name, enabled in (
+        ("verifying", options.verify_images),
+        ("splitting", options.split_spreads),
+        ("slicing", options.slice_strips),
+        ("cropping", options.autocrop),
+        ("grayscale", options.grayscale),
+        ("fitting", options.target_size is not None),
+    ) if enabled] + ["packaging"] + (["validating"] if options.validate and to_path else [])
+    metrics = ProgressMetrics()
+
+    def start_phase(name, pages_total, read_bytes=0):
+        """进入阶段，返回该阶段的 update(current, total)
+
+        read_bytes 为阶段要读取的字节数，按进度计入读取量；打包阶段自己统计，不需要传入。
+        """
+        index = phases.index(name)
+        metrics.set_stage(name, pages_total)
+        counted = [0]
+
+        def update(current, total):
+            part = current / total if total > 0 else 1.0
+            if read_bytes:
+                done = int(min(1.0, part) * read_bytes)
+                metrics.add_bytes(read=done - counted[0])
+                counted[0] = done
+            metrics.update(pages_done=int(part * pages_total), fraction=(index + part) / len(phases))
+            if progress_callback:
+                progress_callback(int(metrics.fraction * 1000), 1000, metrics)
+
+        update(0, 1)
+        return update
+
+    staging_dir = None
+    try:
+        # 图片处理阶段的输出放在临时目录中，打包完成后删除
+        if len(phases) > 1:
+            import tempfile
+            staging_dir = tempfile.mkdtemp(prefix='pic2epub-')
+        # 封面按原始文件名识别，处理后的页面沿用原页面的封面身份
+        covers = _cover_paths(image_paths)
+        # 跨页拆出的页面在书脊中的位置（左页或右页）
+        spreads = {}
+
+        # 先检查完整性，有损坏图片时尽早失败
+        if options.verify_images:
+            update = start_phase("verifying", len(image_paths), _total_size(image_paths))
+            problems = verify_images(image_paths, options.verify_full, options.workers, stop_event, update)
+            image_paths = apply_integrity_policy(image_paths, problems, options.bad_image_policy, staging_dir)
+            if not image_paths:
+                raise ValueError(f"No usable images left:\n{format_integrity_report(problems)}")
+
+        if options.split_spreads:
+            update = start_phase("splitting", len(image_paths), _total_size(image_paths))
+            split, spreads = split_spread_pages(image_paths, staging_dir, options, stop_event, update, covers)
+            image_paths = [page for pages in split for page in pages]
+
+        if options.slice_strips:
+            update = start_phase("slicing", len(image_paths), _total_size(image_paths))
+            sliced = slice_strip_pages(image_paths, staging_dir, options, stop_event, update)
+            covers = {pages[0] for old, pages in zip(image_paths, sliced) if old in covers}
+            spreads = {pages[0]: spreads[old] for old, pages in zip(image_paths, sliced) if old in spreads and len(pages) == 1}
+            image_paths = [page for pages in sliced for page in pages]
+
+        if options.autocrop:
+            update = start_phase("cropping", len(image_paths), _total_size(image_paths))
+            cropped = autocrop_pages(image_paths, staging_dir, options, stop_event, update)
+            covers = {new for old, new in zip(image_paths, cropped) if old in covers}
+            spreads = {new: spreads[old] for old, new in zip(image_paths, cropped) if old in spreads}
+            image_paths = cropped
+
+        if options.grayscale:
+            update = start_phase("grayscale", len(image_paths), _total_size(image_paths))
+            converted = convert_grayscale_pages(image_paths, staging_dir, options, stop_event, update, covers=covers)
+            spreads = {new: spreads[old] for old, new in zip(image_paths, converted) if old in spreads}
+            image_paths = converted
+
+        # 最后按目标大小调整画质，前面各阶段的结果都计入大小
+        if options.target_size is not None:
+            update = start_phase("fitting", len(image_paths), _total_size(image_paths))
+            fitted = fit_pages_to_size(image_paths, staging_dir, options, stop_event, update, covers=covers)
+            spreads = {new: spreads[old] for old, new in zip(image_paths, fitted) if old in spreads}
+            image_paths = fitted
+
+        from contextlib import nullcontext
+
+        with write_gate or nullcontext():
+            _check_cancelled(stop_event)
+            update = start_phase("packaging", len(image_paths))
+            if to_path:
+                def write(path):
+                    _package_epub(image_paths, path, book_title, fingerprint, update, stop_event, options, metrics,
+                                  spreads)
+                    # 校验临时文件，不合格时不替换已有输出
+                    if options.validate:
+                        problems = validate_epub(path, stop_event=stop_event,
+                                                 progress_callback=start_phase("validating", len(image_paths),
+                                                                             os.path.getsize(path)))
+                        if problems:
+                            raise ValueError(f"EPUB validation failed:\n{format_validation_report(problems)}")
+
+                _write_atomically(output_file, write)
+            else:
+                _package_epub(image_paths, output_file, book_title, fingerprint, update, stop_event, options, metrics,
+                              spreads)
+
+        metrics.set_stage("done", len(image_paths))
+        metrics.update(pages_done=len(image_paths), fraction=1.0)
+        if progress_callback:
+            progress_callback(1000, 1000, metrics)
+    finally:
+        if staging_dir:
+            import shutil
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+# 超过该时长（秒）的同名未完成文件视为之前崩溃留下的残留
+STALE_PARTIAL_AGE = 3600
+
+
+def _partial_path(output_path):
+    """在目标目录中生成隐藏的临时文件名"""
+    import uuid
+
+    directory, name = os.path.split(os.path.abspath(output_path))
+    return os.path.join(directory, f".{name}.{uuid.uuid4().hex[:12]}.part")
+
+
+def _remove_stale_partials(output_path):
+    """删除之前中断或崩溃时留下的同名临时文件"""
+    directory, name = os.path.split(os.path.abspath(output_path))
+    prefix = f".{name}."
+    now = time.time()
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.startswith(prefix) and entry.endswith(".part"):
+            path = os.path.join(directory, entry)
+            try:
+                if now - os.path.getmtime(path) > STALE_PARTIAL_AGE:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+def _write_atomically(output_path, write_func):
+    """先写入同目录下的临时文件，成功后原子替换目标文件；失败或取消时删除临时文件"""
+    _remove_stale_partials(output_path)
+    partial = _partial_path(output_path)
+    try:
+        write_func(partial)
+        os.replace(partial, output_path)
+    except BaseException:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
+
+
+def _package_epub(image_paths, output_file, book_title, fingerprint, progress_callback, stop_event, options, metrics=None,
+                  page_spreads=None):
+    """把页面图片打包为EPUB，读写的字节数累计到 metrics
+
+    page_spreads 为 {页面路径: "left"/"right"}，写入书脊的 page-spread-* 属性。
+    """
+    page_spreads = page_spreads or {}
+    from zipfile import ZipFile
+    from lxml import etree
+
+    total_steps = len(image_paths) + 10
+    force_zip64 = options.large_archive == 'zip64'
 
     # 创建container.xml
     container = etree.Element('container', version='1.0', xmlns='urn:oasis:names:tc:opendocument:xmlns:container')
@@ -291,153 +2210,443 @@ def create_epub_from_images(image_paths, output_file, book_title, progress_callb
         'full-path': 'OEBPS/content.opf',
         'media-type': 'application/oebps-package+xml'
     })
-    with open('META-INF/container.xml', 'wb') as f:
-        f.write(etree.tostring(container, pretty_print=True, xml_declaration=True, encoding='UTF-8'))
     
     if progress_callback:
-        progress_callback(1, len(image_paths) + 10)  # 基础步骤
+        progress_callback(1, total_steps)  # 基础步骤
 
     # 创建content.opf
-    opf = etree.Element('package', version='3.0', xmlns='http://www.idpf.org/2007/opf', unique_identifier='bookid')
+    opf = etree.Element('package', version='3.0', xmlns='http://www.idpf.org/2007/opf', **{'unique-identifier': 'bookid'})
     metadata = etree.SubElement(opf, 'metadata', nsmap={
         'dc': 'http://purl.org/dc/elements/1.1/',
         'opf': 'http://www.idpf.org/2007/opf'
     })
-    etree.SubElement(metadata, '{http://purl.org/dc/elements/1.1/}identifier', id='bookid').text = 'urn:uuid:1234567890'
+    # 标识符在所有图片写入后由内容计算
+    identifier = etree.SubElement(metadata, '{http://purl.org/dc/elements/1.1/}identifier', id='bookid')
     etree.SubElement(metadata, '{http://purl.org/dc/elements/1.1/}title').text = book_title
     etree.SubElement(metadata, '{http://purl.org/dc/elements/1.1/}language').text = 'zh'
+    etree.SubElement(metadata, 'meta', name=FINGERPRINT_META_NAME, content=fingerprint)
 
     manifest = etree.SubElement(opf, 'manifest')
     spine = etree.SubElement(opf, 'spine', toc='ncx')
-    etree.SubElement(manifest, 'item', id='ncx', href='toc.ncx', media_type='application/x-dtbncx+xml')
+    if options.right_to_left or options.split_spreads:
+        spine.set('page-progression-direction', 'rtl' if options.right_to_left else 'ltr')
+    if options.split_spreads:
+        # 横屏时并排显示两页，拆开的跨页重新拼在一起
+        etree.SubElement(metadata, 'meta', property='rendition:spread').text = 'landscape'
+
+    etree.SubElement(manifest, 'item', id='ncx', href='toc.ncx', **{'media-type': 'application/x-dtbncx+xml'})
+
+    # 创建NCX目录
+    ncx = etree.Element('ncx', xmlns='http://www.daisy.org/z3986/2005/ncx/', version='2005-1')
+    head = etree.SubElement(ncx, 'head')
+    ncx_uid = etree.SubElement(head, 'meta', name='dtb:uid')
+    for name, content in [('dtb:depth', '1'), ('dtb:totalPageCount', '0'), ('dtb:maxPageNumber', '0')]:
+        etree.SubElement(head, 'meta', name=name, content=content)
+    doc_title = etree.SubElement(ncx, 'docTitle')
+    etree.SubElement(doc_title, 'text').text = book_title
+    nav_map = etree.SubElement(ncx, 'navMap')
+    
+    if progress_callback:
+        progress_callback(2, total_steps)  # 元数据创建完成
+
+    total_images = len(image_paths)
+    image_infos = []
+    with _FinalizeOnSuccess(ZipFile(output_file, 'w')) as epub:
+        # 先添加mimetype（必须是第一个且无压缩）
+        _writestr(epub, 'mimetype', 'application/epub+zip')
+        _writestr(epub, 'META-INF/container.xml', _xml_bytes(container), force_zip64)
+
+        # 添加所有图片页面 - 每个图片处理都会更新进度
+        position = epub.fp.tell()
+        for i, img_path in enumerate(image_paths):
+            # 检查是否取消
+            if stop_event and stop_event.is_set():
+                raise InterruptedError("User cancelled")
+
+            img_filename = f"img_{i:04d}{Path(img_path).suffix}"
+            media_type = get_image_media_type(img_path)
+            arcname = f'OEBPS/images/{img_filename}'
+            if options.strip_jpeg_metadata and media_type == 'image/jpeg':
+                image_infos.append(write_filtered_file(
+                    epub, img_path, arcname,
+                    lambda src, dst: strip_jpeg_metadata(src, dst, options.jpeg_strip_segments, stop_event),
+                    FIXED_ZIP_DATE_TIME, force_zip64))
+            else:
+                image_infos.append(write_stored_file(epub, img_path, arcname, FIXED_ZIP_DATE_TIME, stop_event, force_zip64))
+
+            etree.SubElement(manifest, 'item', id=f'img{i}', href=f'images/{img_filename}', **{'media-type': media_type})
+
+            # 创建XHTML页面
+            xhtml = etree.Element('html', xmlns='http://www.w3.org/1999/xhtml')
+            head = etree.SubElement(xhtml, 'head')
+            etree.SubElement(head, 'title').text = f'Page {i+1}'
+            body = etree.SubElement(xhtml, 'body')
+            etree.SubElement(body, 'img', src=f'../images/{img_filename}', style='width: 100%; height: auto;')
+            _writestr(epub, f'OEBPS/text/page_{i:04d}.xhtml', _xml_bytes(xhtml), force_zip64)
+
+            etree.SubElement(manifest, 'item', id=f'page{i}', href=f'text/page_{i:04d}.xhtml',
+                             **{'media-type': 'application/xhtml+xml'})
+            itemref = etree.SubElement(spine, 'itemref', idref=f'page{i}')
+            if img_path in page_spreads:
+                itemref.set('properties', f'page-spread-{page_spreads[img_path]}')
+
+            # 添加导航点
+            nav_point = etree.SubElement(nav_map, 'navPoint', id=f'navPoint-{i+1}', playOrder=str(i+1))
+            label = etree.SubElement(nav_point, 'navLabel')
+            etree.SubElement(label, 'text').text = f'Page {i+1}'
+            etree.SubElement(nav_point, 'content', src=f'text/page_{i:04d}.xhtml')
+
+            # 每处理一张图片就更新进度
+            if metrics:
+                metrics.add_bytes(read=os.path.getsize(img_path), written=epub.fp.tell() - position)
+                position = epub.fp.tell()
+            if progress_callback:
+                progress_callback(3 + i, total_steps)
+
+        if progress_callback:
+            progress_callback(3 + total_images, total_steps)  # 所有页面创建完成
+
+        # 保存OPF和NCX文件
+        book_uid = f'urn:uuid:{content_uuid(book_title, image_infos)}'
+        identifier.text = book_uid
+        ncx_uid.set('content', book_uid)
+        _writestr(epub, 'OEBPS/content.opf', _xml_bytes(opf), force_zip64)
+        _writestr(epub, 'OEBPS/toc.ncx', _xml_bytes(ncx), force_zip64)
+        epub.comment = FINGERPRINT_COMMENT_PREFIX + fingerprint.encode('ascii')
+
+        if progress_callback:
+            progress_callback(9 + total_images, total_steps)  # 内容文件保存完成
+
+    if progress_callback:
+        progress_callback(10 + total_images, total_steps)  # 100% - 完成
+
+
+# ========== EPUB 校验 ==========
+EPUB_CONTAINER_NS = "urn:oasis:names:tc:opendocument:xmlns:container"
+# 需要完整读入并解析的条目，其余条目只保留文件头用于判断类型
+EPUB_XML_SUFFIXES = (".xml", ".opf", ".ncx", ".xhtml", ".html", ".htm")
+
+
+def _read_entries(zf, stop_event=None, progress_callback=None):
+    """按 zip 中的顺序流式读取每个条目：读完即校验 CRC，返回 ({名称: 内容或文件头}, [问题])
+
+    无法完整读取的条目对应的内容为 None，后续检查会跳过它们。
+    """
+    from zipfile import BadZipFile
+
+    contents = {}
+    problems = []
+    entries = zf.infolist()
+    for i, info in enumerate(entries):
+        if info.is_dir():
+            continue
+        keep_all = info.filename.lower().endswith(EPUB_XML_SUFFIXES)
+        head = b""
+        contents[info.filename] = None
+        try:
+            with zf.open(info) as f:
+                # zipfile 在读到条目末尾时校验 CRC，不一致会抛出 BadZipFile
+                while True:
+                    _check_cancelled(stop_event)
+                    chunk = f.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if keep_all or len(head) < 32:
+                        head += chunk if keep_all else chunk[:32 - len(head)]
+            contents[info.filename] = head
+        except BadZipFile as e:
+            problems.append((info.filename, str(e)))
+        except (OSError, EOFError, NotImplementedError) as e:
+            problems.append((info.filename, f"unreadable entry: {e}"))
+        if progress_callback:
+            progress_callback(i + 1, len(entries))
+    return contents, problems
+
+
+def _resolve_href(base_dir, href):
+    """把 OPF/NCX 中的相对链接解析为 zip 中的条目名，去掉片段标识"""
+    import posixpath
+    from urllib.parse import unquote
+
+    href = unquote(href.split("#", 1)[0])
+    return posixpath.normpath(posixpath.join(base_dir, href)) if base_dir else posixpath.normpath(href)
+
+
+def validate_epub(path, stop_event=None, progress_callback=None):
+    """在进程内校验 EPUB 的结构，不解压到磁盘，返回 [(条目, 问题)]；没有问题时返回空列表
+
+    检查 mimetype 是否为第一个不压缩的条目、container.xml 能否找到 OPF、
+    清单中的每个文件是否存在且媒体类型与文件头一致、书脊与 NCX 是否一致，
+    以及每个条目的 CRC。
+    """
+    import posixpath
+    import struct
+    from zipfile import ZipFile, BadZipFile, ZIP_STORED
+    from lxml import etree
+
+    try:
+        zf = ZipFile(path)
+    except (OSError, BadZipFile) as e:
+        return [(os.fspath(path), f"not a zip archive: {e}")]
+
+    with zf:
+        entries = zf.infolist()
+        contents, problems = _read_entries(zf, stop_event, progress_callback)
+
+        # mimetype 必须是第一个条目、不压缩、没有扩展字段
+        first = entries[0] if entries else None
+        if first is None or first.filename != "mimetype":
+            problems.append(("mimetype", "must be the first entry in the archive"))
+        else:
+            if first.compress_type != ZIP_STORED:
+                problems.append(("mimetype", "must be stored without compression"))
+            if first.flag_bits & 0x08:
+                problems.append(("mimetype", "must not use a data descriptor"))
+            zf.fp.seek(first.header_offset)
+            local_header = zf.fp.read(30)
+            if len(local_header) == 30 and struct.unpack("<H", local_header[28:30])[0]:
+                problems.append(("mimetype", "local header must not have an extra field"))
+            if contents.get("mimetype") != b"application/epub+zip":
+                problems.append(("mimetype", "content must be application/epub+zip"))
+
+    def parse(name):
+        if contents.get(name, b"") is None:
+            return None
+        try:
+            return etree.fromstring(contents[name])
+        except KeyError:
+            problems.append((name, "missing"))
+        except etree.XMLSyntaxError as e:
+            problems.append((name, f"malformed XML: {e}"))
+        return None
+
+    container = parse("META-INF/container.xml")
+    if container is None:
+        return problems
+    rootfile = container.find(f"{{{EPUB_CONTAINER_NS}}}rootfiles/{{{EPUB_CONTAINER_NS}}}rootfile")
+    opf_name = rootfile.get("full-path") if rootfile is not None else None
+    if not opf_name:
+        problems.append(("META-INF/container.xml", "no rootfile full-path"))
+        return problems
+    opf = parse(opf_name)
+    if opf is None:
+        return problems
+    opf_dir = posixpath.dirname(opf_name)
+
+    # 唯一标识符
+    unique_id = opf.get("unique-identifier")
+    identifiers = {el.get("id"): (el.text or "").strip() for el in opf.iterfind("{*}metadata/{*}identifier")}
+    if unique_id not in identifiers:
+        problems.append((opf_name, f"unique-identifier {unique_id!r} does not match a dc:identifier"))
+
+    # 清单
+    manifest = {}
+    for item in opf.iterfind("{*}manifest/{*}item"):
+        item_id, href, media_type = item.get("id"), item.get("href"), item.get("media-type")
+        if not item_id or not href or not media_type:
+            problems.append((opf_name, f"manifest item {item_id or href!r} needs id, href and media-type"))
+            continue
+        if item_id in manifest:
+            problems.append((opf_name, f"duplicate manifest id {item_id!r}"))
+        name = _resolve_href(opf_dir, href)
+        manifest[item_id] = (name, media_type)
+        if name not in contents:
+            problems.append((name, f"listed in the manifest as {item_id!r} but missing from the archive"))
+            continue
+        if contents[name] is None:
+            continue
+        if media_type.startswith("image/"):
+            actual = sniff_image_type(contents[name])
+            if actual != media_type:
+                problems.append((name, f"declared as {media_type} but content is {actual or 'unknown'}"))
+        elif media_type in ("application/xhtml+xml", "application/x-dtbncx+xml"):
+            parse(name)
+
+    # 书脊
+    spine = opf.find("{*}spine")
+    spine_names = []
+    if spine is None:
+        problems.append((opf_name, "missing spine"))
+    else:
+        for itemref in spine.iterfind("{*}itemref"):
+            idref = itemref.get("idref")
+            if idref not in manifest:
+                problems.append((opf_name, f"spine itemref {idref!r} is not in the manifest"))
+            else:
+                spine_names.append(manifest[idref][0])
+        if not spine_names:
+            problems.append((opf_name, "spine is empty"))
+
+    # NCX：导航点必须指向书脊中的页面，播放顺序连续
+    toc_id = spine.get("toc") if spine is not None else None
+    if toc_id:
+        if toc_id not in manifest:
+            problems.append((opf_name, f"spine toc {toc_id!r} is not in the manifest"))
+        elif manifest[toc_id][0] in contents:
+            ncx_name = manifest[toc_id][0]
+            ncx = parse(ncx_name)
+            if ncx is not None:
+                ncx_dir = posixpath.dirname(ncx_name)
+                uid = ncx.find("{*}head/{*}meta[@name='dtb:uid']")
+                if uid is not None and identifiers.get(unique_id) not in (None, uid.get("content")):
+                    problems.append((ncx_name, "dtb:uid does not match the package identifier"))
+                spine_set = set(spine_names)
+                orders = []
+                for point in ncx.iter("{*}navPoint"):
+                    content = point.find("{*}content")
+                    target = _resolve_href(ncx_dir, content.get("src", "")) if content is not None else None
+                    if target not in spine_set:
+                        problems.append((ncx_name, f"navPoint {point.get('id')!r} points to {target!r}, not a spine item"))
+                    if point.get("playOrder"):
+                        orders.append(int(point.get("playOrder")))
+                if orders and sorted(orders) != list(range(1, len(orders) + 1)):
+                    problems.append((ncx_name, "playOrder is not a continuous sequence starting at 1"))
+    return problems
+
+
+def format_validation_report(problems):
+    return "\n".join(f"{name}: {problem}" for name, problem in problems)
+
+
+def validate_epubs(paths, workers=None, stop_event=None, progress_callback=None):
+    """并行校验多本 EPUB，返回 {路径: [(条目, 问题)]}"""
+    paths = list(paths)
+    results = _parallel_map(validate_epub, paths, workers, stop_event, progress_callback)
+    return dict(zip(paths, results))
+
+
+# ========== 书库索引 ==========
+LIBRARY_INDEX_FILE = ".pic2epub-index.json"
+LIBRARY_INDEX_VERSION = 1
+# 修改时间距扫描时刻太近的目录不写入索引：同一时间刻度内的后续改动无法通过 mtime 发现
+MTIME_GRACE_NS = 2 * 10**9
+
+
+class LibraryIndex:
+    """书库根目录下的持久化索引，记录每个子文件夹的 mtime 和已排序的图片列表
+
+    目录中增删或重命名文件都会改变目录的 mtime，因此只需 stat 一次子文件夹
+    就能判断是否要重新扫描。图片内容的修改不会改变目录 mtime，
+    所以索引中的大小只作参考，是否需要重建仍由输入指纹决定。
+    """
+    _open = {}
+    _open_lock = threading.Lock()
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.path = os.path.join(self.root, LIBRARY_INDEX_FILE)
+        self.folders = {}
+        self.dirty = False
+        self.lock = threading.Lock()
+        self.load()
+
+    @classmethod
+    def open(cls, root):
+        """返回书库根目录的索引；同一进程内重复打开时复用已加载的实例"""
+        root = os.path.abspath(root)
+        with cls._open_lock:
+            index = cls._open.get(root)
+            if index is None:
+                index = cls._open[root] = cls(root)
+            return index
+
+    @classmethod
+    def for_folder(cls, folder):
+        """返回已打开且包含 folder 的索引，不读磁盘"""
+        parent = os.path.dirname(os.path.abspath(folder))
+        with cls._open_lock:
+            return cls._open.get(parent)
+
+    def load(self):
+        import json
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get("version") == LIBRARY_INDEX_VERSION:
+            self.folders = data.get("folders") or {}
+
+    def save(self):
+        """有改动时原子写回索引文件；书库只读时放弃写入"""
+        import json
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps({"version": LIBRARY_INDEX_VERSION, "folders": self.folders},
+                              ensure_ascii=False, separators=(",", ":"))
+            self.dirty = False
+
+        def write(path):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(data)
+
+        try:
+            _write_atomically(self.path, write)
+        except OSError:
+            pass
 
-    # 创建NCX目录
-    ncx = etree.Element('ncx', xmlns='http://www.daisy.org/z3986/2005/ncx/', version='2005-1')
-    head = etree.SubElement(ncx, 'head')
-    for name, content in [('dtb:uid', 'urn:uuid:1234567890'), ('dtb:depth', '1'), ('dtb:totalPageCount', '0'), ('dtb:maxPageNumber', '0')]:
-        etree.SubElement(head, 'meta', name=name, content=content)
-    doc_title = etree.SubElement(ncx, 'docTitle')
-    etree.SubElement(doc_title, 'text').text = book_title
-    nav_map = etree.SubElement(ncx, 'navMap')
-    
-    if progress_callback:
-        progress_callback(2, len(image_paths) + 10)  # 元数据创建完成
+    def images(self, folder, stop_event=None):
+        """返回 folder 中已排序的 [(文件名, 大小, 媒体类型)]，目录 mtime 未变时不重新扫描"""
+        name = os.path.basename(os.path.normpath(folder))
+        try:
+            mtime_ns = os.stat(folder).st_mtime_ns
+        except OSError:
+            return []
+        with self.lock:
+            entry = self.folders.get(name)
+        if entry and entry["mtime_ns"] == mtime_ns:
+            return [tuple(item) for item in entry["images"]]
 
-    # 添加所有图片页面 - 每个图片处理都会更新进度
-    total_images = len(image_paths)
-    for i, img_path in enumerate(image_paths):
-        # 检查是否取消
-        if stop_event and stop_event.is_set():
-            raise InterruptedError("User cancelled")
-            
-        img_filename = f"img_{i:04d}{Path(img_path).suffix}"
-        dest_img = f'OEBPS/images/{img_filename}'
-        shutil.copy2(img_path, dest_img)
-        
-        media_type = get_image_media_type(img_path)
-        etree.SubElement(manifest, 'item', id=f'img{i}', href=f'images/{img_filename}', media_type=media_type)
-        
-        # 创建XHTML页面
-        xhtml = etree.Element('html', xmlns='http://www.w3.org/1999/xhtml')
-        head = etree.SubElement(xhtml, 'head')
-        etree.SubElement(head, 'title').text = f'Page {i+1}'
-        body = etree.SubElement(xhtml, 'body')
-        etree.SubElement(body, 'img', src=f'../images/{img_filename}', style='width: 100%; height: auto;')
-        
-        xhtml_path = f'OEBPS/text/page_{i:04d}.xhtml'
-        with open(xhtml_path, 'wb') as f:
-            f.write(etree.tostring(xhtml, pretty_print=True, xml_declaration=True, encoding='UTF-8'))
-        
-        etree.SubElement(manifest, 'item', id=f'page{i}', href=f'text/page_{i:04d}.xhtml', media_type='application/xhtml+xml')
-        etree.SubElement(spine, 'itemref', idref=f'page{i}')
-        
-        # 添加导航点
-        nav_point = etree.SubElement(nav_map, 'navPoint', id=f'navPoint-{i+1}', playOrder=str(i+1))
-        label = etree.SubElement(nav_point, 'navLabel')
-        etree.SubElement(label, 'text').text = f'Page {i+1}'
-        etree.SubElement(nav_point, 'content', src=f'text/page_{i:04d}.xhtml')
-        
-        # 每处理一张图片就更新进度
-        if progress_callback:
-            progress_callback(3 + i, len(image_paths) + 10)
+        images = _list_images(folder, stop_event)
+        with self.lock:
+            if time.time_ns() - mtime_ns > MTIME_GRACE_NS:
+                self.folders[name] = {"mtime_ns": mtime_ns, "images": [list(item) for item in images]}
+            else:
+                self.folders.pop(name, None)
+            self.dirty = True
+        return images
 
-    if progress_callback:
-        progress_callback(3 + total_images, len(image_paths) + 10)  # 所有页面创建完成
+    def prune(self, names):
+        """删除已不存在的子文件夹记录"""
+        with self.lock:
+            stale = set(self.folders) - set(names)
+            for name in stale:
+                del self.folders[name]
+            self.dirty = self.dirty or bool(stale)
 
-    # 保存OPF和NCX文件
-    with open('OEBPS/content.opf', 'wb') as f:
-        f.write(etree.tostring(opf, pretty_print=True, xml_declaration=True, encoding='UTF-8'))
-    with open('OEBPS/toc.ncx', 'wb') as f:
-        f.write(etree.tostring(ncx, pretty_print=True, xml_declaration=True, encoding='UTF-8'))
-    
-    if progress_callback:
-        progress_callback(4 + total_images, len(image_paths) + 10)  # 内容文件保存完成
 
-    # 打包EPUB - 这是最耗时的部分，我们将其分解为多个步骤
-    if progress_callback:
-        progress_callback(5 + total_images, len(image_paths) + 10)  # 开始打包
-    
-    # 收集所有需要打包的文件
-    all_files = []
-    all_files.append(('mimetype', 'mimetype'))
-    
-    # META-INF 文件
-    for root, _, files in os.walk('META-INF'):
-        for f in files:
-            full_path = os.path.join(root, f)
-            rel_path = os.path.relpath(full_path, '.')
-            all_files.append((full_path, rel_path))
-    
-    # OEBPS 文件
-    for root, _, files in os.walk('OEBPS'):
-        for f in files:
-            full_path = os.path.join(root, f)
-            rel_path = os.path.relpath(full_path, '.')
-            all_files.append((full_path, rel_path))
-    
-    # 分批打包文件，每批更新一次进度
-    with ZipFile(output_file, 'w') as epub:
-        # 先添加mimetype（必须无压缩）
-        epub.write('mimetype', compress_type=ZIP_STORED)
-        
-        # 添加其他文件，分批处理
-        batch_size = max(1, len(all_files) // 10)  # 分成10批左右
-        for i in range(0, len(all_files), batch_size):
-            # 检查是否取消
-            if stop_event and stop_event.is_set():
-                raise InterruptedError("User cancelled")
-                
-            batch = all_files[i:i + batch_size]
-            for full_path, rel_path in batch:
-                if rel_path != 'mimetype':  # mimetype已经单独处理
-                    epub.write(full_path, rel_path)
-            
-            # 更新打包进度
-            if progress_callback:
-                progress_value = 5 + total_images + int((i + len(batch)) / len(all_files) * 4)
-                progress_callback(progress_value, len(image_paths) + 10)
-    
-    if progress_callback:
-        progress_callback(9 + total_images, len(image_paths) + 10)  # EPUB打包完成
-
-    # 清理临时文件
-    if os.path.exists('mimetype'):
-        os.remove('mimetype')
-    if os.path.exists('META-INF'):
-        shutil.rmtree('META-INF')
-    if os.path.exists('OEBPS'):
-        shutil.rmtree('OEBPS')
-    
-    if progress_callback:
-        progress_callback(10 + total_images, len(image_paths) + 10)  # 100% - 完成
+def _list_images(folder, stop_event=None):
+    """扫描单个文件夹，返回已排序的 [(文件名, 大小, 媒体类型)]"""
+    found = {}
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if stop_event and stop_event.is_set():
+                    raise InterruptedError("User cancelled")
+                if entry.name.lower().endswith('.epub') or not is_supported_image(entry.name):
+                    continue
+                try:
+                    if entry.is_file():
+                        found[entry.name] = entry.stat().st_size
+                except OSError:
+                    continue
+    except OSError:
+        return []
+    return [(name, found[name], get_image_media_type(name)) for name in sort_image_files(list(found))]
 
 
 def get_valid_subfolders(base_folder, progress_callback=None, stop_event=None):
-    """返回包含至少一张图片的子文件夹列表"""
+    """返回包含至少一张图片的子文件夹列表
+
+    扫描结果保存在书库根目录的索引中，下次只重新扫描 mtime 变化过的子文件夹。
+    """
     subfolders = []
     try:
-        items = [item for item in os.listdir(base_folder) 
-                if os.path.isdir(os.path.join(base_folder, item))]
+        index = LibraryIndex.open(base_folder)
+        with os.scandir(base_folder) as entries:
+            items = sorted(entry.name for entry in entries if entry.is_dir())
+        index.prune(items)
         
         for i, item in enumerate(items):
             # 检查是否取消
@@ -445,13 +2654,14 @@ def get_valid_subfolders(base_folder, progress_callback=None, stop_event=None):
                 raise InterruptedError("User cancelled")
                 
             path = os.path.join(base_folder, item)
-            if os.path.isdir(path):
-                imgs, _ = scan_images(path, stop_event=stop_event)
-                if imgs:
-                    subfolders.append(path)
+            if index.images(path, stop_event):
+                subfolders.append(path)
             
             if progress_callback:
                 progress_callback(i + 1, len(items))
+        index.save()
+    except InterruptedError:
+        raise
     except Exception:
         pass
     return subfolders
@@ -485,6 +2695,9 @@ def get_all_images_from_subfolders(base_folder, progress_callback=None, stop_eve
 class ScanProgressWindow:
     """扫描进度窗口"""
     def __init__(self, parent, lang="中文"):
+        import tkinter as tk
+        from tkinter import ttk
+
         self.window = tk.Toplevel(parent)
         self.lang = lang
         tr = lambda k: LANGUAGES[lang].get(k, k)
@@ -520,7 +2733,7 @@ class ScanProgressWindow:
 
     def on_close(self):
         self.cancel()
-        self.window.destroy()
+        self.close()
 
     def cancel(self):
         self.stop_event.set()
@@ -541,12 +2754,18 @@ class ScanProgressWindow:
         self.window.update_idletasks()
 
     def close(self):
+        # 窗口关闭后后台线程的回调可能还会到达
+        if self._closed:
+            return
         self._closed = True
         self.window.destroy()
 
 
 class ProgressWindow:
     def __init__(self, parent, is_batch=False, total_books=1, lang="中文"):
+        import tkinter as tk
+        from tkinter import ttk
+
         self.window = tk.Toplevel(parent)
         self.lang = lang
         tr = lambda k: LANGUAGES[lang].get(k, k)
@@ -571,6 +2790,7 @@ class ProgressWindow:
         self.animation_index = 0
         self.animation_chars = ["⠋", "⠙", "⠹", "⠸", "⠼", "⠴", "⠦", "⠧", "⠇", "⠏"]
         self.current_book = ""
+        self.stage = None
 
         # 总进度（仅批量）
         if is_batch:
@@ -588,6 +2808,10 @@ class ProgressWindow:
         self.current_label.pack()
         self.current_bar = ttk.Progressbar(self.window, length=400, mode='determinate')
         self.current_bar.pack(pady=(2, 5))
+
+        # 速率和剩余时间
+        self.metrics_label = tk.Label(self.window, text="", font=("微软雅黑", 8), fg="gray")
+        self.metrics_label.pack()
         
         # 添加动画指示器
         self.animation_label = tk.Label(self.window, text="", font=("微软雅黑", 12))
@@ -618,7 +2842,7 @@ class ProgressWindow:
         tr = lambda k: LANGUAGES[self.lang].get(k, k)
         
         # 检查是否在打包阶段
-        if "打包" in self.current_label.cget("text") or "Packaging" in self.current_label.cget("text"):
+        if self.stage == "packaging":
             # 在打包阶段显示更明显的动画
             self.animation_index = (self.animation_index + 1) % len(self.animation_chars)
             animation_char = self.animation_chars[self.animation_index]
@@ -659,7 +2883,7 @@ class ProgressWindow:
             self.overall_bar['value'] = done
             self.window.update_idletasks()
 
-    def update_current(self, current, total):
+    def update_current(self, current, total, metrics=None):
         if self._closed:
             return
             
@@ -669,9 +2893,16 @@ class ProgressWindow:
         
         tr = lambda k: LANGUAGES[self.lang].get(k, k)
         
-        # 根据进度显示不同的状态信息
-        if percent >= 95:
-            status_text = tr("packaging")
+        # 状态信息来自流水线实际所处的阶段
+        if metrics:
+            self.stage = metrics.stage
+            status_text = tr(f"stage_{metrics.stage}")
+            self.metrics_label.config(text=tr("progress_metrics").format(
+                pages=metrics.pages_per_sec,
+                read=metrics.read_bytes_per_sec / 1e6,
+                written=metrics.write_bytes_per_sec / 1e6,
+                eta=metrics.format_eta(),
+            ))
         else:
             status_text = tr("processing")
             
@@ -688,16 +2919,33 @@ class ProgressWindow:
 
 
 class OverwritePolicy:
-    """覆盖策略管理器"""
-    def __init__(self):
-        self.global_decision = None  # 'skip', 'overwrite', 'cancel'
+    """覆盖策略管理器
+
+    decision 预先给定时（例如服务模式或命令行）不会弹出对话框。
+    plan() 在开始转换前一次性决定所有冲突，之后工作线程不会再停下来等待对话框。
+    """
+    def __init__(self, decision=None):
+        self.global_decision = decision  # 'skip', 'overwrite', 'cancel'
+        self.decisions = {}  # 预先规划的 {输出路径: 'skip'/'overwrite'}
+        self.parent_window = None
+
+    def plan(self, decisions, default="skip"):
+        """记录预先规划的决定；规划之外的冲突（如分卷输出）使用 default"""
+        self.decisions.update({os.path.abspath(path): decision for path, decision in decisions.items()})
+        if not self.global_decision:
+            self.global_decision = default
     
-    def should_overwrite(self, parent, filename, lang="中文"):
+    def should_overwrite(self, parent, path, lang="中文"):
         """检查是否应该覆盖文件"""
+        decision = self.decisions.get(os.path.abspath(path))
+        if decision:
+            return decision == "overwrite"
         if self.global_decision:
             return self.global_decision != "skip"
+        if parent is None:
+            return False  # 没有界面可以询问时不覆盖
         
-        dialog = OverwriteDialog(parent, filename, lang)
+        dialog = OverwriteDialog(parent, os.path.basename(path), lang)
         
         if dialog.apply_all:
             self.global_decision = dialog.result
@@ -708,53 +2956,108 @@ class OverwritePolicy:
         return dialog.result == "overwrite"
 
 
-def run_single_conversion(folder, update_current, stop_event, lang="中文", output_dir=None, overwrite_policy=None, progress_win=None):
-    """执行单个文件夹的转换"""
+def get_output_path(folder, output_dir=None):
+    """单本书的输出路径：输出目录或原文件夹中的 文件夹名.epub"""
+    folder_name = os.path.basename(os.path.normpath(folder))
+    # 如果指定了输出目录，则保存到输出目录，否则保存到原文件夹
+    return os.path.join(output_dir or folder, folder_name + ".epub")
+
+
+def get_merged_output_path(base_folder):
+    """合并模式的输出路径：父文件夹中的 父文件夹名_merged.epub"""
+    folder_name = os.path.basename(os.path.normpath(base_folder))
+    return os.path.join(base_folder, folder_name + "_merged.epub")
+
+
+def find_output_conflicts(output_paths):
+    """返回已经存在的输出文件"""
+    return [path for path in output_paths if os.path.exists(path)]
+
+
+def scan_book(folder, output_dir=None, progress_callback=None, stop_event=None):
+    """扫描一本书，返回 (排序后的页面路径列表, 输出路径, 书名)"""
+    image_files, _ = scan_images(folder, progress_callback, stop_event)
+    image_paths = [os.path.join(folder, f) for f in sort_image_files(image_files)]
+    return image_paths, get_output_path(folder, output_dir), os.path.basename(os.path.normpath(folder))
+
+
+def book_targets(image_paths, output_path, book_title, options, warn=True):
+    """按大型归档策略列出一本书实际要写出的 [(页面列表, 输出路径, 书名)]，分卷时每卷一项"""
+    volumes = plan_volumes(image_paths, options, warn)
+    if len(volumes) == 1:
+        return [(image_paths, output_path, book_title)]
+    stem = os.path.splitext(output_path)[0]
+    return [
+        (pages, f"{stem}_vol{n:02d}.epub", f"{book_title} ({n}/{len(volumes)})")
+        for n, pages in enumerate(volumes, 1)
+    ]
+
+
+def find_pending_conflicts(books, progress_callback=None, stop_event=None):
+    """books 为 [(页面列表, 输出路径, 书名, 选项)]，返回需要决定是否覆盖的已有输出
+
+    包括分卷输出；输入未变化、转换时会直接跳过的输出不在其中。
+    progress_callback(current, total) 按输出文件报告进度，stop_event 被设置时抛出 InterruptedError。
+    """
+    targets = []
+    for image_paths, output_path, book_title, options in books:
+        if stop_event and stop_event.is_set():
+            raise InterruptedError("User cancelled")
+        for pages, path, title in book_targets(image_paths, output_path, book_title, options, warn=False):
+            targets.append((pages, path, title, options))
+
+    conflicts = []
+    for i, (pages, path, title, options) in enumerate(targets):
+        if stop_event and stop_event.is_set():
+            raise InterruptedError("User cancelled")
+        if os.path.exists(path) and not (options.skip_unchanged and is_output_up_to_date(path, pages, title, options)):
+            conflicts.append(path)
+        if progress_callback:
+            progress_callback(i + 1, len(targets))
+    return conflicts
+
+
+def run_single_conversion(folder, update_current, stop_event, lang="中文", output_dir=None, overwrite_policy=None, progress_win=None, options=None,
+                          write_gate=None):
+    """执行单个文件夹的转换
+
+    update_current 接受第三个参数时会收到 ProgressMetrics，否则按 (current, total) 调用。
+    """
+    options = (options or ConversionOptions()).for_book(folder)
+    update_current = _metrics_progress(update_current)
     # 设置当前书籍名称
     if progress_win:
         folder_name = os.path.basename(os.path.normpath(folder))
         progress_win.set_current_book(folder_name)
     
     # 扫描图片 - 占30%进度
+    scan_metrics = ProgressMetrics("scanning")
+
     def update_scan_progress(current, total):
         # 将扫描进度映射到总进度的0-30%
         mapped_current = int(current / total * 30) if total > 0 else 0
-        update_current(mapped_current, 100)
+        scan_metrics.update(pages_done=current, fraction=current / total if total > 0 else 0.0)
+        update_current(mapped_current, 100, scan_metrics)
     
-    image_files, _ = scan_images(folder, update_scan_progress, stop_event)
-    if not image_files:
+    image_paths, output_path, book_title = scan_book(folder, output_dir, update_scan_progress, stop_event)
+    if not image_paths:
         raise ValueError(LANGUAGES[lang]["warning_no_images"])
 
-    sorted_image_files = sort_image_files(image_files)
-    image_paths = [os.path.join(folder, f) for f in sorted_image_files]
-    
-    folder_name = os.path.basename(os.path.normpath(folder))
-    epub_name = folder_name + ".epub"
-    
-    # 如果指定了输出目录，则保存到输出目录，否则保存到原文件夹
-    if output_dir:
-        output_path = os.path.join(output_dir, epub_name)
-    else:
-        output_path = os.path.join(folder, epub_name)
-    
-    # 检查文件是否已存在
-    if os.path.exists(output_path):
-        if overwrite_policy and not overwrite_policy.should_overwrite(overwrite_policy.parent_window, epub_name, lang):
-            return None  # 跳过这个文件
-    
     # 生成EPUB - 占70%进度
-    def update_epub_progress(current, total):
+    def update_epub_progress(current, total, metrics=None):
         # 将EPUB生成进度映射到总进度的30-100%
         mapped_current = 30 + int(current / total * 70) if total > 0 else 30
-        update_current(mapped_current, 100)
+        update_current(mapped_current, 100, metrics)
     
-    book_title = folder_name
-    create_epub_from_images(image_paths, output_path, book_title, update_epub_progress, stop_event)
-    return output_path
+    return _build_book(image_paths, output_path, book_title, update_epub_progress, stop_event, lang, overwrite_policy, options,
+                       write_gate)
 
 
-def run_merged_conversion(base_folder, image_paths, update_current, stop_event, lang="中文", overwrite_policy=None, progress_win=None):
+def run_merged_conversion(base_folder, image_paths, update_current, stop_event, lang="中文", overwrite_policy=None, progress_win=None, options=None,
+                          write_gate=None):
     """执行合并转换（所有子文件夹图片合并到一个EPUB）"""
+    options = (options or ConversionOptions()).for_book(base_folder)
+    update_current = _metrics_progress(update_current)
     if not image_paths:
         raise ValueError(LANGUAGES[lang]["warning_no_images"])
 
@@ -764,17 +3067,45 @@ def run_merged_conversion(base_folder, image_paths, update_current, stop_event,
         progress_win.set_current_book(folder_name + " (合并版)")
 
     folder_name = os.path.basename(os.path.normpath(base_folder))
-    epub_name = folder_name + "_merged.epub"
-    output_path = os.path.join(base_folder, epub_name)
-    
-    # 检查文件是否已存在
-    if os.path.exists(output_path):
-        if overwrite_policy and not overwrite_policy.should_overwrite(overwrite_policy.parent_window, epub_name, lang):
-            return None  # 跳过这个文件
-    
+    output_path = get_merged_output_path(base_folder)
     book_title = folder_name + " (Merged)"
-    create_epub_from_images(image_paths, output_path, book_title, update_current, stop_event)
-    return output_path
+    return _build_book(image_paths, output_path, book_title, update_current, stop_event, lang, overwrite_policy, options,
+                       write_gate)
+
+
+def _build_book(image_paths, output_path, book_title, update_current, stop_event, lang, overwrite_policy, options,
+                write_gate=None):
+    """生成一本书，返回输出路径；按大型归档策略分卷时返回路径列表；全部跳过时返回 None"""
+    targets = book_targets(image_paths, output_path, book_title, options)
+
+    generated = []
+    for index, (pages, path, title) in enumerate(targets):
+        # 输入没有变化时直接跳过，不必询问覆盖
+        if options.skip_unchanged and is_output_up_to_date(path, pages, title, options):
+            continue
+
+        # 检查文件是否已存在
+        if os.path.exists(path):
+            if overwrite_policy and not overwrite_policy.should_overwrite(overwrite_policy.parent_window, path, lang):
+                continue  # 跳过这个文件
+
+        def update_volume(current, total, metrics=None, index=index):
+            update_current(index * total + current, len(targets) * total, metrics)
+
+        create_epub_from_images(pages, path, title, update_volume, stop_event, options, write_gate)
+        generated.append(path)
+
+    if len(targets) > 1:
+        return generated or None
+    return generated[0] if generated else None
+
+
+def _add_generated(generated, output_path):
+    """把 run_*_conversion 的返回值（路径、分卷列表或 None）加入已生成列表"""
+    if isinstance(output_path, list):
+        generated.extend(output_path)
+    elif output_path:
+        generated.append(output_path)
 
 
 def run_batch_conversion(folders, progress_win, finish_callback, lang="中文", output_dir=None, overwrite_policy=None):
@@ -787,13 +3118,12 @@ def run_batch_conversion(folders, progress_win, finish_callback, lang="中文",
                 break
             progress_win.update_overall(idx, total)
 
-            def update_current(c, t):
-                progress_win.update_current(c, t)
+            def update_current(c, t, metrics=None):
+                progress_win.update_current(c, t, metrics)
 
             try:
                 output_path = run_single_conversion(folder, update_current, progress_win.stop_event, lang, output_dir, overwrite_policy, progress_win)
-                if output_path:  # 只有当不跳过时才添加到列表
-                    generated_epubs.append(output_path)
+                _add_generated(generated_epubs, output_path)  # 只有当不跳过时才添加到列表
             except InterruptedError:
                 # 用户取消，跳出循环
                 break
@@ -821,16 +3151,15 @@ def run_merged_batch_conversion(base_folder, progress_win, finish_callback, lang
         if not image_paths:
             raise ValueError(LANGUAGES[lang]["warning_no_images"])
         
-        def update_current(c, t):
-            progress_win.update_current(c, t)
+        def update_current(c, t, metrics=None):
+            progress_win.update_current(c, t, metrics)
 
         # 执行合并转换
         output_path = run_merged_conversion(base_folder, image_paths, update_current, progress_win.stop_event, lang, overwrite_policy, progress_win)
         
-        if output_path:  # 只有当不跳过时才添加到列表
-            finish_callback(success=True, generated=[output_path], lang=lang)
-        else:
-            finish_callback(success=True, generated=[], lang=lang)
+        generated = []
+        _add_generated(generated, output_path)  # 只有当不跳过时才添加到列表
+        finish_callback(success=True, generated=generated, lang=lang)
 
     except InterruptedError:
         finish_callback(success=False, cancelled=True, generated=[], lang=lang)
@@ -838,6 +3167,518 @@ def run_merged_batch_conversion(base_folder, progress_win, finish_callback, lang
         finish_callback(success=False, error=str(e), generated=[], lang=lang)
 
 
+# ========== 多书库调度 ==========
+class DeviceStats:
+    """一个存储设备上的转换统计"""
+    def __init__(self, device, limit):
+        self.device = device
+        self.limit = limit
+        self.label = None  # 该设备上的第一本书，用于显示
+        self.books_done = 0
+        self.books_skipped = 0
+        self.books_failed = 0
+        self.pages = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+
+    def record(self, metrics, skipped=False, failed=False):
+        with self.lock:
+            if failed:
+                self.books_failed += 1
+            elif skipped:
+                self.books_skipped += 1
+            else:
+                self.books_done += 1
+            # 只有成功生成的书计入吞吐量
+            if metrics and not failed and not skipped:
+                self.pages += metrics.pages_done
+                self.bytes_read += metrics.bytes_read
+                self.bytes_written += metrics.bytes_written
+            self.finished = time.monotonic()
+
+    def as_dict(self):
+        elapsed = (self.finished - self.started) if self.started and self.finished else 0.0
+        return {
+            # Windows 上没有 os.major/os.minor，直接显示 st_dev
+            "device": f"{os.major(self.device)}:{os.minor(self.device)}" if hasattr(os, "major") else str(self.device),
+            "example": self.label,
+            "limit": self.limit,
+            "books_done": self.books_done,
+            "books_skipped": self.books_skipped,
+            "books_failed": self.books_failed,
+            "pages": self.pages,
+            "read_mb": round(self.bytes_read / 1e6, 1),
+            "written_mb": round(self.bytes_written / 1e6, 1),
+            "seconds": round(elapsed, 2),
+            "pages_per_sec": round(self.pages / elapsed, 1) if elapsed else 0.0,
+            "read_mb_per_sec": round(self.bytes_read / 1e6 / elapsed, 1) if elapsed else 0.0,
+            "write_mb_per_sec": round(self.bytes_written / 1e6 / elapsed, 1) if elapsed else 0.0,
+        }
+
+
+class BatchScheduler:
+    """多个书库根目录的批量转换：按所在设备（st_dev）分组，每个设备有独立的并发上限
+
+    固态硬盘可以多本书同时转换，机械硬盘和网络存储只开一路，避免并发寻道互相拖慢。
+    device_limits 为 {st_dev: 并发数}，未列出的设备使用 default_limit。
+    """
+    def __init__(self, device_limits=None, default_limit=2, output_dir=None, overwrite="skip", options=None,
+                 lang="中文", stop_event=None, book_callback=None):
+        self.device_limits = dict(device_limits or {})
+        self.default_limit = max(1, default_limit)
+        self.output_dir = output_dir
+        self.overwrite = overwrite
+        self.options = options
+        self.lang = lang
+        self.stop_event = stop_event or threading.Event()
+        self.book_callback = book_callback  # book_callback(书籍文件夹, 输出路径或 None, 错误或 None)
+        self.devices = {}
+        self.started = None
+        self.finished = None
+
+    @staticmethod
+    def expand_roots(patterns):
+        """展开书库路径和通配符，返回去重后的目录列表"""
+        import glob
+
+        roots = []
+        seen = set()
+        for pattern in patterns:
+            pattern = os.path.expanduser(pattern)
+            matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+            for path in matches:
+                real = os.path.realpath(path)
+                if os.path.isdir(path) and real not in seen:
+                    seen.add(real)
+                    roots.append(path)
+        return roots
+
+    def collect_books(self, patterns):
+        """返回 [(书籍文件夹, 输出目录)]：含图片子文件夹的根目录按单独模式展开，否则根目录本身是一本书"""
+        books = []
+        for root in self.expand_roots(patterns):
+            subfolders = get_valid_subfolders(root, stop_event=self.stop_event)
+            if subfolders:
+                books.extend((folder, self.output_dir or root) for folder in subfolders)
+            elif scan_images(root, stop_event=self.stop_event)[0]:
+                books.append((root, self.output_dir))
+        return books
+
+    def _device_stats(self, folder):
+        device = os.stat(folder).st_dev
+        stats = self.devices.get(device)
+        if stats is None:
+            stats = self.devices[device] = DeviceStats(device, self.device_limits.get(device, self.default_limit))
+            stats.label = folder
+        return stats
+
+    def run(self, patterns):
+        """转换所有书库中的书籍，返回 (生成的EPUB列表, [(书籍文件夹, 错误)])
+
+        输出冲突在开始前按 overwrite 统一决定；单本书失败不影响其他书籍。
+        """
+        from concurrent.futures import ThreadPoolExecutor, wait
+
+        books = self.collect_books(patterns)
+        if not books:
+            raise ValueError(LANGUAGES[self.lang]["warning_no_images"])
+        overwrite_policy = OverwritePolicy()
+        conflicts = find_output_conflicts([get_output_path(folder, out_dir) for folder, out_dir in books])
+        overwrite_policy.plan({path: self.overwrite for path in conflicts}, default=self.overwrite)
+
+        by_device = {}
+        for folder, out_dir in books:
+            by_device.setdefault(self._device_stats(folder).device, []).append((folder, out_dir))
+
+        generated = []
+        failures = []
+        results_lock = threading.Lock()
+
+        def convert(folder, out_dir, stats):
+            if self.stop_event.is_set():
+                return
+            final = {}
+
+            def update_current(current, total, metrics=None):
+                if metrics and metrics.stage != "scanning":
+                    final["metrics"] = metrics
+
+            with stats.lock:
+                stats.started = stats.started or time.monotonic()
+            try:
+                output_path = run_single_conversion(folder, update_current, self.stop_event, self.lang, out_dir,
+                                                    overwrite_policy, options=self.options)
+            except InterruptedError:
+                return
+            except Exception as e:
+                stats.record(final.get("metrics"), failed=True)
+                with results_lock:
+                    failures.append((folder, str(e)))
+                if self.book_callback:
+                    self.book_callback(folder, None, str(e))
+                return
+            stats.record(final.get("metrics"), skipped=output_path is None)
+            with results_lock:
+                _add_generated(generated, output_path)
+            if self.book_callback:
+                self.book_callback(folder, output_path, None)
+
+        self.started = time.monotonic()
+        executors = []
+        try:
+            futures = []
+            for device, device_books in by_device.items():
+                executor = ThreadPoolExecutor(max_workers=self.devices[device].limit,
+                                              thread_name_prefix=f"pic2epub-dev{device}")
+                executors.append(executor)
+                futures.extend(executor.submit(convert, folder, out_dir, self.devices[device])
+                               for folder, out_dir in device_books)
+            # 分段等待，使 Ctrl+C 能及时生效
+            while wait(futures, timeout=0.5).not_done:
+                pass
+            for future in futures:
+                future.result()
+        except BaseException:
+            self.stop_event.set()
+            raise
+        finally:
+            for executor in executors:
+                executor.shutdown(wait=True)
+            self.finished = time.monotonic()
+        return generated, failures
+
+    def report(self):
+        """返回按设备和汇总的吞吐统计"""
+        devices = [stats.as_dict() for stats in self.devices.values()]
+        elapsed = (self.finished - self.started) if self.started and self.finished else 0.0
+        total = {key: sum(d[key] for d in devices)
+                 for key in ("books_done", "books_skipped", "books_failed", "pages", "read_mb", "written_mb")}
+        total["seconds"] = round(elapsed, 2)
+        total["pages_per_sec"] = round(total["pages"] / elapsed, 1) if elapsed else 0.0
+        total["read_mb_per_sec"] = round(total["read_mb"] / elapsed, 1) if elapsed else 0.0
+        total["write_mb_per_sec"] = round(total["written_mb"] / elapsed, 1) if elapsed else 0.0
+        return {"devices": devices, "total": total}
+
+
+# ========== 服务模式 ==========
+JOB_MODES = ("single", "separate", "merge")
+OVERWRITE_DECISIONS = ("skip", "overwrite")
+
+
+class ConversionJob:
+    """服务模式中的一个转换任务"""
+    def __init__(self, job_id, folder, mode="single", output_dir=None, overwrite="skip", options=None):
+        self.id = job_id
+        self.folder = folder
+        self.mode = mode
+        self.output_dir = output_dir
+        self.overwrite = overwrite
+        self.options = options or ConversionOptions()
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.books_total = 0
+        self.books_done = 0
+        self.current_book = None
+        self.current_progress = 0.0
+        self.metrics = None
+        self.outputs = []
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.stop_event = threading.Event()
+
+    @property
+    def progress(self):
+        if self.status == "done":
+            return 1.0
+        if not self.books_total:
+            return 0.0
+        return min(1.0, (self.books_done + self.current_progress) / self.books_total)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "folder": self.folder,
+            "mode": self.mode,
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "books_total": self.books_total,
+            "books_done": self.books_done,
+            "current_book": self.current_book,
+            "metrics": self.metrics.as_dict() if self.metrics else None,
+            "outputs": list(self.outputs),
+            "error": self.error,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class ConversionServer:
+    """常驻的转换服务：预热的工作线程池 + 任务队列
+
+    workers 限制同时运行的任务数，io_slots 限制同时写出EPUB的书籍数，
+    max_queue 限制排队中的任务数，process_workers 是每个任务图片处理进程数的上限（默认 CPU 核数），
+    防止多个调用方压垮机器。
+    """
+    def __init__(self, workers=2, io_slots=1, max_queue=100, max_history=1000, lang="中文", process_workers=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        # 预先加载 Pillow/lxml，之后每个任务都不再付出初始化开销
+        warm_up_imports()
+        self.workers = workers
+        self.io_slots = io_slots
+        self.max_queue = max_queue
+        self.process_workers = max(1, process_workers or os.cpu_count() or 1)
+        self.max_history = max_history
+        self.lang = lang
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._io_semaphore = threading.BoundedSemaphore(io_slots)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pic2epub-worker")
+
+    def submit(self, folder, mode="single", output_dir=None, overwrite="skip", options=None):
+        """提交任务，参数无效时抛出 ValueError，队列已满时抛出 OverflowError"""
+        if mode not in JOB_MODES:
+            raise ValueError(f"Unknown mode: {mode}")
+        if overwrite not in OVERWRITE_DECISIONS:
+            raise ValueError(f"Unknown overwrite policy: {overwrite}")
+        if not folder or not os.path.isdir(folder):
+            raise ValueError(LANGUAGES[self.lang]["error_invalid_folder"])
+        if output_dir and not os.path.isdir(output_dir):
+            raise ValueError(LANGUAGES[self.lang]["error_invalid_folder"])
+        # 调用方请求的进程数不能超过服务器的上限
+        options = options or ConversionOptions()
+        options = options.copy(workers=min(options.workers or self.process_workers, self.process_workers))
+
+        with self._lock:
+            queued = sum(1 for job in self.jobs.values() if job.status == "queued")
+            if queued >= self.max_queue:
+                raise OverflowError("Job queue is full")
+            job = ConversionJob(str(self._next_id), folder, mode, output_dir, overwrite, options)
+            self._next_id += 1
+            self.jobs[job.id] = job
+            self._prune_history()
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def cancel(self, job_id):
+        """取消任务；排队中的任务直接取消，运行中的任务在下一个检查点停止"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.stop_event.set()
+        with self._lock:
+            if job.status == "queued":
+                job.status = "cancelled"
+                job.finished = time.time()
+        return job
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return {"workers": self.workers, "io_slots": self.io_slots, "max_queue": self.max_queue,
+                "process_workers": self.process_workers, "jobs": counts}
+
+    def shutdown(self, cancel_running=True):
+        if cancel_running:
+            for job in self.list_jobs():
+                job.stop_event.set()
+        self._executor.shutdown(wait=True)
+
+    def _prune_history(self):
+        """只保留最近 max_history 个已结束的任务"""
+        finished = [job for job in self.jobs.values() if job.finished is not None]
+        for job in sorted(finished, key=lambda j: j.finished)[:max(0, len(finished) - self.max_history)]:
+            del self.jobs[job.id]
+
+    def _convert_book(self, job, convert):
+        """转换一本书：convert(update, write_gate)，只有写出 EPUB 时占用 I/O 限额"""
+        def update_current(current, total, metrics=None):
+            job.current_progress = current / total if total > 0 else 0.0
+            job.metrics = metrics
+
+        job.current_progress = 0.0
+        if job.stop_event.is_set():
+            raise InterruptedError("User cancelled")
+        output_path = convert(update_current, self._io_semaphore)
+        _add_generated(job.outputs, output_path)
+        job.books_done += 1
+        job.current_progress = 0.0
+
+    def _run(self, job):
+        with self._lock:
+            if job.status != "queued":
+                return
+            job.status = "running"
+            job.started = time.time()
+
+        policy = OverwritePolicy(job.overwrite)
+        lang = self.lang
+        try:
+            if job.mode == "single":
+                job.books_total = 1
+                job.current_book = os.path.basename(os.path.normpath(job.folder))
+                self._convert_book(job, lambda update, gate: run_single_conversion(
+                    job.folder, update, job.stop_event, lang, job.output_dir, policy, options=job.options,
+                    write_gate=gate))
+            elif job.mode == "separate":
+                folders = get_valid_subfolders(job.folder, stop_event=job.stop_event)
+                if not folders:
+                    raise ValueError(LANGUAGES[lang]["warning_no_images"])
+                job.books_total = len(folders)
+                output_dir = job.output_dir or job.folder
+                for folder in folders:
+                    job.current_book = os.path.basename(os.path.normpath(folder))
+                    self._convert_book(job, lambda update, gate, folder=folder: run_single_conversion(
+                        folder, update, job.stop_event, lang, output_dir, policy, options=job.options,
+                        write_gate=gate))
+            else:
+                job.books_total = 1
+                job.current_book = os.path.basename(os.path.normpath(job.folder))
+                image_paths = get_all_images_from_subfolders(job.folder, stop_event=job.stop_event)
+                self._convert_book(job, lambda update, gate: run_merged_conversion(
+                    job.folder, image_paths, update, job.stop_event, lang, policy, options=job.options,
+                    write_gate=gate))
+            job.status = "done"
+        except InterruptedError:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            job.current_book = None
+            job.finished = time.time()
+
+
+def _make_request_handler(server):
+    """创建绑定到 ConversionServer 的 HTTP 请求处理类"""
+    import json
+    from http.server import BaseHTTPRequestHandler
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        server_version = "Pic2EPUB"
+
+        def address_string(self):
+            # Unix 套接字的 client_address 是空字符串
+            return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _job_id(self):
+            parts = self.path.strip("/").split("/")
+            if len(parts) == 2 and parts[0] == "jobs":
+                return parts[1]
+            return None
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/jobs":
+                self._send_json(200, [job.to_dict() for job in server.list_jobs()])
+            elif self.path.rstrip("/") == "/health":
+                self._send_json(200, server.stats())
+            else:
+                job = server.get(self._job_id())
+                if job is None:
+                    self._send_json(404, {"error": "job not found"})
+                else:
+                    self._send_json(200, job.to_dict())
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/jobs":
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not isinstance(request, dict):
+                    raise ValueError("request body must be a JSON object")
+                job = server.submit(
+                    request.get("folder"),
+                    request.get("mode", "single"),
+                    request.get("output_dir"),
+                    request.get("overwrite", "skip"),
+                    ConversionOptions.from_dict(request.get("options")),
+                )
+            except OverflowError as e:
+                self._send_json(503, {"error": str(e)})
+            except (ValueError, TypeError) as e:
+                self._send_json(400, {"error": str(e)})
+            else:
+                self._send_json(202, job.to_dict())
+
+        def do_DELETE(self):
+            job = server.cancel(self._job_id())
+            if job is None:
+                self._send_json(404, {"error": "job not found"})
+            else:
+                self._send_json(200, job.to_dict())
+
+        def log_message(self, format, *args):
+            sys.stderr.write(f"[pic2epub] {self.address_string()} {format % args}\n")
+
+    return RequestHandler
+
+
+def serve(listen="127.0.0.1:8765", workers=2, io_slots=1, max_queue=100, lang="中文", process_workers=None):
+    """启动转换服务，listen 为 host:port 或 unix:/path/to.sock"""
+    import socketserver
+    import stat
+    from http.server import ThreadingHTTPServer
+
+    socket_path = listen[len("unix:"):] if listen.startswith("unix:") else None
+    if socket_path and os.path.lexists(socket_path):
+        # 只删除上次遗留的套接字，不删除同名的普通文件
+        if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            raise ValueError(f"{socket_path} exists and is not a socket")
+        os.remove(socket_path)
+
+    server = ConversionServer(workers=workers, io_slots=io_slots, max_queue=max_queue, lang=lang,
+                              process_workers=process_workers)
+    handler = _make_request_handler(server)
+
+    if socket_path:
+
+        class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        httpd = UnixHTTPServer(socket_path, handler)
+    else:
+        host, _, port = listen.rpartition(":")
+        httpd = ThreadingHTTPServer((host or "127.0.0.1", int(port)), handler)
+
+    sys.stderr.write(f"[pic2epub] serving on {listen} (workers={workers}, io_slots={io_slots})\n")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        server.shutdown()
+        shutdown_process_pools()
+        if socket_path and os.path.lexists(socket_path) and stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+            os.remove(socket_path)
+
+
 class App:
     def __init__(self, root):
         self.root = root
@@ -849,6 +3690,9 @@ class App:
         return LANGUAGES[self.current_lang].get(key, key)
 
     def create_widgets(self):
+        import tkinter as tk
+        from tkinter import ttk
+
         # 主窗口设置
         self.root.title(self.tr("window_title"))
         self.root.geometry("500x200")
@@ -923,6 +3767,7 @@ class App:
         self.btn_convert.config(text=tr("confirm"))
 
     def select_folder(self):
+        from tkinter import filedialog
         folder = filedialog.askdirectory(title=self.tr("folder_label"))
         if folder:
             self.folder_var.set(folder)
@@ -964,10 +3809,12 @@ class App:
 
     def on_scan_error(self, error):
         """扫描错误回调"""
+        from tkinter import messagebox
         self.scan_progress.close()
         messagebox.showerror("Error", f"扫描文件夹时出错：{error}")
 
     def on_convert(self):
+        from tkinter import messagebox
         folder = self.folder_var.get().strip()
         if not folder or not os.path.isdir(folder):
             messagebox.showerror("Error", self.tr("error_invalid_folder"))
@@ -978,6 +3825,8 @@ class App:
 
     def process_after_scan(self):
         """扫描完成后处理"""
+        import tkinter as tk
+
         folder = self.folder_var.get().strip()
         subfolders = self.scan_result
         
@@ -1061,13 +3910,69 @@ class App:
         else:
             self.start_conversion([folder])
 
+    def plan_overwrites(self, scan, start):
+        """开始转换前一次性处理所有输出冲突（包括分卷输出），确定覆盖策略后调用 start(overwrite_policy)
+
+        扫描和冲突检查在后台线程中进行，期间显示扫描进度窗口并可取消；
+        scan(progress_callback, stop_event) 返回 [(文件夹, 页面列表, 输出路径, 书名)]。
+        输入未变化的输出会被直接跳过，不再询问；规划后工作线程不会再弹出覆盖对话框。
+        """
+        self.scan_progress = ScanProgressWindow(self.root, lang=self.current_lang)
+        stop_event = self.scan_progress.stop_event
+
+        def plan_thread():
+            def update_progress(current, total):
+                self.root.after(0, lambda: self.scan_progress.update_scan(current, total))
+
+            try:
+                planned = []
+                for folder, image_paths, output_path, book_title in scan(update_progress, stop_event):
+                    try:
+                        options = ConversionOptions().for_book(folder)
+                    except (OSError, ValueError):
+                        continue  # 选项文件有误时由转换过程报告错误
+                    planned.append((image_paths, output_path, book_title, options))
+                conflicts = find_pending_conflicts(planned, update_progress, stop_event)
+                self.root.after(0, lambda: self.on_plan_complete(conflicts, start))
+            except InterruptedError:
+                self.root.after(0, self.on_scan_cancelled)
+            except Exception as e:
+                error = str(e)
+                self.root.after(0, lambda: self.on_scan_error(error))
+
+        threading.Thread(target=plan_thread, daemon=True).start()
+
+    def on_plan_complete(self, conflicts, start):
+        """冲突检查完成回调：在界面线程中询问覆盖，然后开始转换"""
+        if self.scan_progress.stop_event.is_set():
+            self.scan_progress.close()
+            return
+        self.scan_progress.close()
+
+        overwrite_policy = OverwritePolicy()
+        if conflicts:
+            dialog = ConflictDialog(self.root, conflicts, lang=self.current_lang)
+            if dialog.result is None:
+                return
+            overwrite_policy.plan(dialog.result, default=dialog.default)
+        else:
+            overwrite_policy.plan({}, default="skip")
+        start(overwrite_policy)
+
     def start_conversion(self, folders, is_batch=False, output_dir=None):
         """启动单独转换"""
+        def scan(progress_callback, stop_event):
+            books = []
+            for i, folder in enumerate(folders):
+                books.append((folder,) + scan_book(folder, output_dir, stop_event=stop_event))
+                progress_callback(i + 1, len(folders))
+            return books
+
+        self.plan_overwrites(scan, lambda overwrite_policy: self._run_conversion(
+            folders, is_batch, output_dir, overwrite_policy))
+
+    def _run_conversion(self, folders, is_batch, output_dir, overwrite_policy):
         self.progress_win = ProgressWindow(self.root, is_batch=is_batch, total_books=len(folders), lang=self.current_lang)
-        
-        # 创建覆盖策略管理器
-        overwrite_policy = OverwritePolicy()
-        overwrite_policy.parent_window = self.root
 
         def finish_callback(success, generated=None, error=None, cancelled=False, lang=None):
             self.root.after(0, lambda: self._on_finish(success, generated, error, cancelled, lang))
@@ -1081,11 +3986,15 @@ class App:
 
     def start_merged_conversion(self, base_folder):
         """启动合并转换"""
+        def scan(progress_callback, stop_event):
+            folder_name = os.path.basename(os.path.normpath(base_folder))
+            image_paths = get_all_images_from_subfolders(base_folder, progress_callback, stop_event)
+            return [(base_folder, image_paths, get_merged_output_path(base_folder), folder_name + " (Merged)")]
+
+        self.plan_overwrites(scan, lambda overwrite_policy: self._run_merged_conversion(base_folder, overwrite_policy))
+
+    def _run_merged_conversion(self, base_folder, overwrite_policy):
         self.progress_win = ProgressWindow(self.root, is_batch=False, total_books=1, lang=self.current_lang)
-        
-        # 创建覆盖策略管理器
-        overwrite_policy = OverwritePolicy()
-        overwrite_policy.parent_window = self.root
 
         def finish_callback(success, generated=None, error=None, cancelled=False, lang=None):
             self.root.after(0, lambda: self._on_finish(success, generated, error, cancelled, lang))
@@ -1098,6 +4007,7 @@ class App:
         thread.start()
 
     def _on_finish(self, success, generated=None, error=None, cancelled=False, lang=None):
+        from tkinter import messagebox
         self.progress_win.close()
         tr = self.tr
 
@@ -1118,8 +4028,265 @@ class App:
                 messagebox.showerror("Error", tr("error_conversion_failed").format(error=error))
 
 
-if __name__ == "__main__":
+def run_gui():
+    """启动图形界面"""
+    import tkinter as tk
+
     check_and_install_deps()
     root = tk.Tk()
-    app = App(root)
-    root.mainloop()
\ No newline at end of file
+    App(root)
+    # 窗口先显示出来，Pillow/lxml 在后台线程中加载
+    threading.Thread(target=warm_up_imports, daemon=True).start()
+    root.mainloop()
+
+
+def _parse_option_args(pairs):
+    """解析命令行的 KEY=VALUE 选项，VALUE 按 JSON 解析，失败时作为字符串"""
+    import json
+
+    data = {}
+    for pair in pairs or []:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise ValueError(f"Expected KEY=VALUE, got: {pair}")
+        try:
+            data[key.strip()] = json.loads(value)
+        except ValueError:
+            data[key.strip()] = value
+    return ConversionOptions.from_dict(data)
+
+
+def _cli_progress(label):
+    """命令行进度显示"""
+    def update(current, total, metrics=None):
+        percent = int(current / total * 100) if total > 0 else 0
+        line = f"\r{label}: {percent:3d}%"
+        if metrics:
+            line += (f" {metrics.stage:<10} {metrics.pages_per_sec:6.1f} pages/s"
+                     f" read {metrics.read_bytes_per_sec / 1e6:6.1f} MB/s"
+                     f" write {metrics.write_bytes_per_sec / 1e6:6.1f} MB/s ETA {metrics.format_eta()}")
+        sys.stderr.write(line)
+        sys.stderr.flush()
+    return update
+
+
+def stream_book(folder, stream, mode="single", progress_callback=None, stop_event=None, options=None, lang="中文"):
+    """把一本书（single）或合并后的整个文件夹（merge）直接写入二进制流，不在磁盘上落地"""
+    if mode == "merge":
+        image_paths = get_all_images_from_subfolders(folder, stop_event=stop_event)
+        book_title = os.path.basename(os.path.normpath(folder)) + " (Merged)"
+    else:
+        options = (options or ConversionOptions()).for_book(folder)
+        image_paths, _, book_title = scan_book(folder, stop_event=stop_event)
+    if not image_paths:
+        raise ValueError(LANGUAGES[lang]["warning_no_images"])
+    options = options or ConversionOptions()
+    # 流只能写一本书，无法分卷；超出上限时改用 ZIP64
+    if len(plan_volumes(image_paths, options)) > 1:
+        options = options.copy(large_archive="zip64")
+    create_epub_from_images(image_paths, stream, book_title, progress_callback, stop_event, options)
+    stream.flush()
+
+
+def _prepare_output_dir(output_dir):
+    """开始转换前创建命令行指定的输出目录，路径已被普通文件占用时抛出 ValueError"""
+    if not output_dir:
+        return
+    if os.path.exists(output_dir) and not os.path.isdir(output_dir):
+        raise ValueError(f"--output-dir {output_dir} exists and is not a directory")
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+    except OSError as e:
+        raise ValueError(f"--output-dir {output_dir} cannot be created: {e.strerror or e}")
+
+
+def run_cli_conversion(folder, mode="single", output_dir=None, overwrite="skip", options=None, lang="中文"):
+    """在命令行中执行转换，返回生成的EPUB列表
+
+    输出冲突在开始前按 overwrite 策略统一决定，转换过程中不会停下来询问。
+    """
+    stop_event = threading.Event()
+    if mode != "merge":
+        _prepare_output_dir(output_dir)
+    if mode == "separate":
+        folders = get_valid_subfolders(folder, stop_event=stop_event)
+        if not folders:
+            raise ValueError(LANGUAGES[lang]["warning_no_images"])
+        output_paths = [get_output_path(f, output_dir or folder) for f in folders]
+    elif mode == "merge":
+        folders = [folder]
+        output_paths = [get_merged_output_path(folder)]
+    else:
+        folders = [folder]
+        output_paths = [get_output_path(folder, output_dir)]
+
+    overwrite_policy = OverwritePolicy()
+    conflicts = find_output_conflicts(output_paths)
+    overwrite_policy.plan({path: overwrite for path in conflicts}, default=overwrite)
+    if conflicts:
+        action = "overwritten" if overwrite == "overwrite" else "skipped"
+        sys.stderr.write(f"{len(conflicts)} existing output(s) will be {action} unless unchanged\n")
+
+    generated = []
+    try:
+        for book_folder in folders:
+            label = os.path.basename(os.path.normpath(book_folder))
+            if mode == "merge":
+                image_paths = get_all_images_from_subfolders(book_folder, stop_event=stop_event)
+                output_path = run_merged_conversion(book_folder, image_paths, _cli_progress(label), stop_event,
+                                                    lang, overwrite_policy, options=options)
+            else:
+                output_path = run_single_conversion(book_folder, _cli_progress(label), stop_event, lang,
+                                                    output_dir or (folder if mode == "separate" else None),
+                                                    overwrite_policy, options=options)
+            sys.stderr.write("\n")
+            _add_generated(generated, output_path)
+    except KeyboardInterrupt:
+        stop_event.set()
+        raise
+    return generated
+
+
+def _parse_device_limits(pairs):
+    """解析 PATH=N 形式的设备并发上限，PATH 可以是该设备上的任意路径"""
+    limits = {}
+    for pair in pairs or []:
+        path, sep, value = pair.rpartition("=")
+        if not sep or not value.isdigit() or int(value) < 1:
+            raise ValueError(f"Expected PATH=N, got: {pair}")
+        limits[os.stat(os.path.expanduser(path)).st_dev] = int(value)
+    return limits
+
+
+def run_cli_batch(roots, output_dir=None, overwrite="skip", options=None, device_limits=None, default_limit=2,
+                  lang="中文"):
+    """在命令行中按设备并发转换多个书库，逐本输出结果，最后输出各设备的吞吐统计"""
+    def book_done(folder, output_path, error):
+        name = os.path.basename(os.path.normpath(folder))
+        if error:
+            sys.stderr.write(f"failed  {name}: {error}\n")
+        else:
+            sys.stderr.write(f"{'done' if output_path else 'skipped':<7} {name}\n")
+
+    _prepare_output_dir(output_dir)
+    scheduler = BatchScheduler(device_limits, default_limit, output_dir, overwrite, options, lang,
+                               book_callback=book_done)
+    generated, failures = scheduler.run(roots)
+
+    report = scheduler.report()
+    for device in report["devices"]:
+        sys.stderr.write(
+            f"device {device['device']} (e.g. {device['example']}, limit {device['limit']}): "
+            f"{device['books_done']} built, {device['books_skipped']} skipped, {device['books_failed']} failed, "
+            f"{device['pages_per_sec']} pages/s, read {device['read_mb_per_sec']} MB/s, "
+            f"write {device['write_mb_per_sec']} MB/s\n")
+    total = report["total"]
+    sys.stderr.write(
+        f"total: {total['books_done']} built in {total['seconds']} s, {total['pages_per_sec']} pages/s, "
+        f"read {total['read_mb_per_sec']} MB/s, write {total['write_mb_per_sec']} MB/s\n")
+    return generated, failures
+
+
+def main(argv=None):
+    """命令行入口：不带参数时启动图形界面"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="pic2epub", description="Convert image folders to EPUB")
+    subparsers = parser.add_subparsers(dest="command")
+
+    convert_parser = subparsers.add_parser("convert", help="convert a folder without the GUI")
+    convert_parser.add_argument("folder")
+    convert_parser.add_argument("--mode", choices=JOB_MODES, default="single")
+    convert_parser.add_argument("--output-dir", help="directory for generated EPUBs")
+    convert_parser.add_argument("--stdout", action="store_true",
+                                help="write the EPUB to standard output instead of a file (single/merge mode)")
+    convert_parser.add_argument("--overwrite", choices=OVERWRITE_DECISIONS, default="skip",
+                                help="what to do with existing outputs, decided before any work starts")
+    convert_parser.add_argument("--option", action="append", metavar="KEY=VALUE",
+                                help="conversion option, e.g. grayscale=true (repeatable)")
+    convert_parser.add_argument("--lang", choices=list(LANGUAGES.keys()), default="中文")
+
+    batch_parser = subparsers.add_parser("batch", help="convert many libraries, grouped by storage device")
+    batch_parser.add_argument("roots", nargs="+", help="library folders or glob patterns")
+    batch_parser.add_argument("--output-dir", help="directory for generated EPUBs")
+    batch_parser.add_argument("--overwrite", choices=OVERWRITE_DECISIONS, default="skip")
+    batch_parser.add_argument("--option", action="append", metavar="KEY=VALUE",
+                              help="conversion option, e.g. grayscale=true (repeatable)")
+    batch_parser.add_argument("--device-limit", action="append", metavar="PATH=N",
+                              help="concurrent books on the device holding PATH (repeatable)")
+    batch_parser.add_argument("--default-limit", type=int, default=2, help="concurrent books on other devices")
+    batch_parser.add_argument("--lang", choices=list(LANGUAGES.keys()), default="中文")
+
+    validate_parser = subparsers.add_parser("validate", help="check the structure of generated EPUBs")
+    validate_parser.add_argument("epubs", nargs="+")
+    validate_parser.add_argument("--workers", type=int, help="EPUBs checked in parallel (default: CPU count)")
+
+    serve_parser = subparsers.add_parser("serve", help="run a local conversion server")
+    serve_parser.add_argument("--listen", default="127.0.0.1:8765", help="host:port or unix:/path/to.sock")
+    serve_parser.add_argument("--workers", type=int, default=2, help="concurrent jobs")
+    serve_parser.add_argument("--io-slots", type=int, default=1, help="books written to disk at the same time")
+    serve_parser.add_argument("--max-queue", type=int, default=100, help="maximum queued jobs")
+    serve_parser.add_argument("--process-workers", type=int,
+                              help="upper limit on image processes per job (default: CPU count)")
+    serve_parser.add_argument("--lang", choices=list(LANGUAGES.keys()), default="中文")
+
+    args = parser.parse_args(argv)
+    if args.command == "convert":
+        try:
+            options = _parse_option_args(args.option)
+            if args.stdout:
+                if args.mode == "separate":
+                    raise ValueError("--stdout writes a single EPUB; use --mode single or merge")
+                label = os.path.basename(os.path.normpath(args.folder))
+                stream_book(args.folder, sys.stdout.buffer, args.mode, _cli_progress(label), options=options,
+                            lang=args.lang)
+                sys.stderr.write("\n")
+                return 0
+            generated = run_cli_conversion(args.folder, args.mode, args.output_dir, args.overwrite, options, args.lang)
+        except (ValueError, OSError) as e:
+            sys.stderr.write(f"error: {e}\n")
+            return 1
+        except (KeyboardInterrupt, InterruptedError):
+            sys.stderr.write("\ncancelled\n")
+            return 130
+        for path in generated:
+            print(path)
+    elif args.command == "batch":
+        try:
+            options = _parse_option_args(args.option)
+            generated, failures = run_cli_batch(args.roots, args.output_dir, args.overwrite, options,
+                                                _parse_device_limits(args.device_limit), args.default_limit,
+                                                args.lang)
+        except (ValueError, OSError) as e:
+            sys.stderr.write(f"error: {e}\n")
+            return 1
+        except (KeyboardInterrupt, InterruptedError):
+            sys.stderr.write("\ncancelled\n")
+            return 130
+        for path in generated:
+            print(path)
+        return 1 if failures else 0
+    elif args.command == "validate":
+        results = validate_epubs(args.epubs, args.workers)
+        failed = [path for path, problems in results.items() if problems]
+        for path in failed:
+            print(f"{path}:")
+            print("  " + format_validation_report(results[path]).replace("\n", "\n  "))
+        print(f"{len(results) - len(failed)}/{len(results)} EPUBs valid")
+        return 1 if failed else 0
+    elif args.command == "serve":
+        try:
+            serve(args.listen, args.workers, args.io_slots, args.max_queue, args.lang, args.process_workers)
+        except (ValueError, OSError) as e:
+            sys.stderr.write(f"error: {e}\n")
+            return 1
+    else:
+        run_gui()
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    finally:
+        shutdown_process_pools()